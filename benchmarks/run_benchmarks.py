@@ -0,0 +1,268 @@
+import os
+import sys
+import json
+import time
+import platform
+import argparse
+import resource
+import subprocess
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+
+benchmark_dir = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(benchmark_dir))
+
+import main
+import utils
+import windowing
+import feature_cache
+import feature_format
+import synthetic
+
+data_dir = os.path.join(benchmark_dir, 'data')
+results_dir = os.path.join(benchmark_dir, 'results')
+stages = ['extract', 'windowing', 'classify', 'regression', 'infer', 'prepare_regression_data', 'quantization']
+
+def peak_rss_mb():
+    # ru_maxrss survives fork and exec on Linux, so a stage process would report the parent's peak;
+    # VmHWM starts over with each new address space
+    try:
+        with open('/proc/self/status', 'r') as f:
+            for line in f:
+                if line.startswith('VmHWM:'):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports kilobytes, macOS bytes
+    return peak / (1024 ** 2 if sys.platform == 'darwin' else 1024)
+
+def git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=benchmark_dir, capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def audio_paths(settings):
+    return [os.path.join(settings['data_dir'], name + '.wav') for name in sorted(settings['transitions'])]
+
+def load_corpus_features(settings):
+    return [feature_cache.load_features(path, settings['feature_dir'], sr=main.sr, hop_length=main.hop_length) for path in audio_paths(settings)]
+
+def ensure_models(model_dir, backend):
+    # Untrained models cost the same to run as trained ones
+    main.model_dir = model_dir
+    classification_model, regression_model = main.load_models(backend)
+    if classification_model is not None:
+        return
+    import model
+    import numpy_model
+    os.makedirs(model_dir, exist_ok=True)
+    num_features = feature_cache.default_params['n_mfcc']
+    builds = (
+        ('classification_model', model.build_classification_model, main.window_size),
+        ('regression_model', model.build_regression_model, main.regression_window_size),
+    )
+    for name, build, seconds in builds:
+        keras_model = build((windowing.seconds_to_frames(seconds, main.sr, main.hop_length), num_features))
+        model.save_model(keras_model, os.path.join(model_dir, name + '.h5'))
+        numpy_model.export_model(keras_model, os.path.join(model_dir, name + '.npz'))
+    print(f"Built untrained models in {model_dir}")
+
+def bench_extract(settings):
+    paths = audio_paths(settings)
+    start = time.perf_counter()
+    frames = sum(len(utils.extract_features(path, sr=main.sr, hop_length=main.hop_length, block_seconds=feature_cache.stream_block_seconds)) for path in paths)
+    return time.perf_counter() - start, {'files': len(paths), 'frames': frames}
+
+def bench_windowing(settings):
+    features_list = load_corpus_features(settings)
+    window_frames = windowing.seconds_to_frames(main.window_size, main.sr, main.hop_length)
+    hop_frames = windowing.seconds_to_frames(main.window_hop, main.sr, main.hop_length)
+    regression_frames = windowing.seconds_to_frames(main.regression_window_size, main.sr, main.hop_length)
+    split_points = [settings['transitions'][name] for name in sorted(settings['transitions'])]
+    start = time.perf_counter()
+    num_windows = 0
+    for features, points in zip(features_list, split_points):
+        num_windows += len(np.ascontiguousarray(windowing.frame_windows(features, window_frames, hop_frames)))
+        windowing.window_labels(len(features), points, window_frames, hop_frames, sr=main.sr, hop_length=main.hop_length)
+        start_frames = [windowing.time_to_frame(max(point - main.regression_window_size / 2, 0), main.sr, main.hop_length) for point in points]
+        windowing.gather_windows(features, start_frames, regression_frames)
+    return time.perf_counter() - start, {'windows': num_windows}
+
+def classification_batch(features_list):
+    window_frames = windowing.seconds_to_frames(main.window_size, main.sr, main.hop_length)
+    hop_frames = windowing.seconds_to_frames(main.window_hop, main.sr, main.hop_length)
+    segments_list = [windowing.frame_windows(features, window_frames, hop_frames) for features in features_list]
+    return segments_list, np.concatenate(segments_list)
+
+def bench_classify(settings):
+    classification_model, _ = main.load_models(settings['backend'])
+    _, segments = classification_batch(load_corpus_features(settings))
+    start = time.perf_counter()
+    classification_model.predict(segments, verbose=0)
+    return time.perf_counter() - start, {'windows': len(segments)}
+
+def bench_regression(settings):
+    classification_model, regression_model = main.load_models(settings['backend'])
+    features_list = load_corpus_features(settings)
+    durations = [utils.get_audio_duration(path) for path in audio_paths(settings)]
+    segments_list, segments = classification_batch(features_list)
+    probs = classification_model.predict(segments, verbose=0).flatten()
+    offsets = np.cumsum([0] + [len(file_segments) for file_segments in segments_list])
+    # The peak picking and regression part of main.detect_transitions_batch
+    start = time.perf_counter()
+    windows_list = []
+    for i, features in enumerate(features_list):
+        midpoints = utils.select_transition_points(probs[offsets[i]:offsets[i + 1]], window_size=main.window_size, num_transitions=main.num_transitions,
+                                                   window_hop=main.window_hop, threshold=main.transition_threshold, sr=main.sr, hop_length=main.hop_length)
+        windows_list.append(utils.get_regression_windows(features, midpoints, main.regression_window_size, durations[i], sr=main.sr, hop_length=main.hop_length)[1])
+    windows = np.concatenate(windows_list)
+    if len(windows):
+        regression_model.predict(windows, verbose=0)
+    return time.perf_counter() - start, {'regression_windows': len(windows)}
+
+def bench_infer(settings):
+    classification_model, regression_model = main.load_models(settings['backend'])
+    features_list = load_corpus_features(settings)
+    durations = [utils.get_audio_duration(path) for path in audio_paths(settings)]
+    start = time.perf_counter()
+    results = main.detect_transitions_batch(features_list, durations, classification_model, regression_model)
+    return time.perf_counter() - start, {'transitions': sum(len(result) for result in results if result is not None)}
+
+def bench_prepare_regression_data(settings):
+    classification_model, _ = main.load_models(settings['backend'])
+    # Timed without cached probability tracks, so every run measures the same work
+    feature_cache.drop_probabilities(settings['feature_dir'])
+    start = time.perf_counter()
+    regression_features, _ = utils.prepare_regression_data(settings['data_dir'], settings['feature_dir'], settings['transitions'], classification_model,
+                                                            sr=main.sr, hop_length=main.hop_length, window_size=main.window_size,
+                                                            window_hop=main.window_hop, regression_window_size=main.regression_window_size)
+    return time.perf_counter() - start, {'regression_windows': 0 if regression_features is None else len(regression_features)}
+
+def bench_quantization(settings):
+    # Disk size, random window reads and drift of each storage format against the float32 frames
+    classification_model, regression_model = main.load_models(settings['backend'])
+    features_list = load_corpus_features(settings)
+    durations = [windowing.frames_duration(len(features), main.sr, main.hop_length) for features in features_list]
+    window_frames = windowing.seconds_to_frames(main.window_size, main.sr, main.hop_length)
+    baseline_windows = np.concatenate([windowing.frame_windows(features, window_frames) for features in features_list])
+    baseline_probs = classification_model.predict(baseline_windows, verbose=0).flatten()
+    baseline_transitions = main.detect_transitions_batch(features_list, durations, classification_model, regression_model)
+    rng = np.random.default_rng(0)
+    formats = {}
+    start = time.perf_counter()
+    for storage in feature_format.storage_formats:
+        drift = {'max_abs_error': 0.0, 'rms_error': 0.0}
+        restored_list = []
+        read_seconds = 0.0
+        for i, features in enumerate(features_list):
+            path = os.path.join(settings['data_dir'], f'quantization_{i}.mfq')
+            with open(path, 'wb') as f:
+                feature_format.write(f, features, storage)
+            file_drift, restored = feature_format.drift(features, storage)
+            drift['max_abs_error'] = max(drift['max_abs_error'], file_drift['max_abs_error'])
+            drift['rms_error'] = max(drift['rms_error'], file_drift['rms_error'])
+            drift['bytes_per_frame'] = os.path.getsize(path) / max(len(features), 1)
+            restored_list.append(restored)
+            mapped = feature_format.read(path, mmap_mode='r')
+            starts = rng.integers(0, max(len(features) - window_frames, 1), 100)
+            read_start = time.perf_counter()
+            windowing.gather_windows(mapped, starts, window_frames)
+            read_seconds += time.perf_counter() - read_start
+            os.remove(path)
+        windows = np.concatenate([windowing.frame_windows(restored, window_frames) for restored in restored_list])
+        transitions = main.detect_transitions_batch(restored_list, durations, classification_model, regression_model)
+        drift['window_read_ms'] = 1000 * read_seconds / (100 * len(features_list))
+        drift['max_probability_drift'] = float(np.abs(classification_model.predict(windows, verbose=0).flatten() - baseline_probs).max())
+        drift['max_transition_drift'] = max((float(np.abs(np.sort(a) - np.sort(b)).max()) for a, b in zip(transitions, baseline_transitions)
+                                             if a is not None and b is not None and len(a) == len(b) and len(a)), default=0.0)
+        drift['same_transition_count'] = all((a is None) == (b is None) and (a is None or len(a) == len(b)) for a, b in zip(transitions, baseline_transitions))
+        formats[storage] = drift
+        print(f"  {storage:8s} {drift['bytes_per_frame']:6.1f} bytes/frame, max error {drift['max_abs_error']:.3g}, "
+              f"probability drift {drift['max_probability_drift']:.2e}, transition drift {drift['max_transition_drift']:.3f}s")
+    return time.perf_counter() - start, {'formats': formats}
+
+def run_stage(name, settings):
+    # Each stage runs in a fresh process so its peak RSS is its own
+    main.model_dir = settings['model_dir']
+    bench = globals()['bench_' + name]
+    profile = None
+    if settings['profile_dir']:
+        import cProfile
+        profile = cProfile.Profile()
+        profile.enable()
+    seconds, counters = bench(settings)
+    if profile:
+        profile.disable()
+        profile.dump_stats(os.path.join(settings['profile_dir'], name + '.prof'))
+    result = {'seconds': seconds, 'peak_rss_mb': peak_rss_mb()}
+    result.update(counters)
+    return result
+
+def compare(results, baseline_path):
+    with open(baseline_path, 'r') as f:
+        baseline = json.load(f)
+    print(f"Compared with {baseline.get('commit')} ({os.path.basename(baseline_path)}):")
+    for name, result in results['stages'].items():
+        previous = baseline.get('stages', {}).get(name)
+        if previous and previous['seconds']:
+            print(f"  {name:24s} {result['seconds'] / previous['seconds'] - 1:+7.1%} time, {result['peak_rss_mb'] - previous['peak_rss_mb']:+8.1f} MB peak RSS")
+
+def main_benchmarks():
+    parser = argparse.ArgumentParser(description="Benchmark extraction, windowing and inference on synthetic audio")
+    parser.add_argument('--files', type=int, default=2, help='Synthetic episodes to generate')
+    parser.add_argument('--hours', type=float, default=0.5, help='Length of each episode')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--backend', choices=['keras', 'numpy'], default='numpy')
+    parser.add_argument('--models', default=None, help='Model directory (default: untrained models built under benchmarks/data)')
+    parser.add_argument('--stages', nargs='+', choices=stages, default=stages)
+    parser.add_argument('--profile', default=None, help='Directory to write a cProfile dump per stage')
+    parser.add_argument('--output', default=None, help='Results file (default: benchmarks/results/<commit>-<time>.json)')
+    parser.add_argument('--compare', default=None, help='Earlier results file to print the change against')
+    args = parser.parse_args()
+    corpus_dir = os.path.join(data_dir, f'{args.files}x{args.hours:g}h-seed{args.seed}')
+    transitions = synthetic.generate_corpus(corpus_dir, args.files, args.hours * 3600, sr=main.sr, seed=args.seed)
+    settings = {
+        'data_dir': corpus_dir,
+        'feature_dir': os.path.join(corpus_dir, 'features'),
+        'model_dir': args.models or os.path.join(data_dir, 'models'),
+        'backend': args.backend,
+        'transitions': transitions,
+        'profile_dir': args.profile,
+    }
+    if args.profile:
+        os.makedirs(args.profile, exist_ok=True)
+    ensure_models(settings['model_dir'], args.backend)
+    # Stages other than extract read the feature cache, filled here outside any timing
+    feature_cache.extract_all(audio_paths(settings), settings['feature_dir'], sr=main.sr, hop_length=main.hop_length)
+    audio_seconds = args.files * args.hours * 3600
+    results = {
+        'commit': git_commit(),
+        'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'platform': platform.platform(),
+        'python': platform.python_version(),
+        'numpy': np.__version__,
+        'cpu_count': os.cpu_count(),
+        'config': {'files': args.files, 'hours': args.hours, 'seed': args.seed, 'backend': args.backend, 'window_size': main.window_size,
+                   'window_hop': main.window_hop, 'regression_window_size': main.regression_window_size},
+        'stages': {},
+    }
+    context = multiprocessing.get_context('spawn')
+    for name in args.stages:
+        with ProcessPoolExecutor(max_workers=1, mp_context=context) as executor:
+            result = executor.submit(run_stage, name, settings).result()
+        result['realtime_factor'] = audio_seconds / result['seconds'] if result['seconds'] else None
+        results['stages'][name] = result
+        print(f"{name:24s} {result['seconds']:8.3f}s {result['realtime_factor'] or 0:10.0f}x realtime {result['peak_rss_mb']:8.1f} MB peak RSS")
+    output_path = args.output or os.path.join(results_dir, f"{results['commit'] or 'unknown'}-{time.strftime('%Y%m%d-%H%M%S')}.json")
+    os.makedirs(os.path.dirname(os.path.abspath(output_path)), exist_ok=True)
+    with open(output_path, 'w') as f:
+        json.dump(results, f, indent=1)
+    print(f"Results written to {output_path}")
+    if args.compare:
+        compare(results, args.compare)
+
+if __name__ == '__main__':
+    main_benchmarks()
@@ -0,0 +1,63 @@
+import os
+import json
+import numpy as np
+import soundfile as sf
+
+block_seconds = 10
+
+def plan_sections(duration, min_section, max_section, rng):
+    boundaries = [0.0]
+    while boundaries[-1] < duration:
+        boundaries.append(boundaries[-1] + rng.uniform(min_section, max_section))
+    boundaries[-1] = duration
+    return boundaries
+
+def tone_block(t, fundamental, rng):
+    # Harmonic tone with slow vibrato, standing in for music
+    phase = 2 * np.pi * fundamental * (t + 0.002 * np.sin(2 * np.pi * 5 * t))
+    block = sum(np.sin(k * phase) / k for k in range(1, 5))
+    return 0.2 * block + 0.01 * rng.standard_normal(len(t))
+
+def noise_block(t, syllable_rate, rng):
+    # Noise bursts at a syllable rate, standing in for speech
+    envelope = 0.5 * (1 + np.sin(2 * np.pi * syllable_rate * t)) ** 2
+    noise = rng.standard_normal(len(t))
+    noise[1:] += 0.9 * noise[:-1]
+    return 0.05 * envelope * noise
+
+def generate_episode(path, duration, sr=22050, min_section=60, max_section=600, seed=0):
+    # Written block by block so hours of audio never sit in memory
+    rng = np.random.default_rng(seed)
+    boundaries = plan_sections(duration, min_section, max_section, rng)
+    block_samples = int(block_seconds * sr)
+    with sf.SoundFile(path, 'w', samplerate=sr, channels=1, subtype='PCM_16') as f:
+        for section, (start, end) in enumerate(zip(boundaries[:-1], boundaries[1:])):
+            fundamental = rng.uniform(110, 330)
+            syllable_rate = rng.uniform(3, 6)
+            first, last = int(start * sr), int(end * sr)
+            for offset in range(first, last, block_samples):
+                t = np.arange(offset, min(offset + block_samples, last)) / sr
+                block = tone_block(t, fundamental, rng) if section % 2 else noise_block(t, syllable_rate, rng)
+                f.write(np.clip(block, -1, 1).astype(np.float32))
+    return boundaries[1:-1]
+
+def generate_corpus(directory, num_files, duration, sr=22050, seed=0):
+    # Reused when a corpus with the same settings already exists
+    os.makedirs(directory, exist_ok=True)
+    config = {'num_files': num_files, 'duration': duration, 'sr': sr, 'seed': seed}
+    manifest_path = os.path.join(directory, 'corpus.json')
+    try:
+        with open(manifest_path, 'r') as f:
+            manifest = json.load(f)
+        if manifest['config'] == config and all(os.path.exists(os.path.join(directory, name + '.wav')) for name in manifest['transitions']):
+            return manifest['transitions']
+    except (FileNotFoundError, json.JSONDecodeError, KeyError):
+        pass
+    transitions = {}
+    for i in range(num_files):
+        name = f'synthetic_{i:03d}'
+        print(f"Generating {name}.wav ({duration / 3600:.2f} h)")
+        transitions[name] = generate_episode(os.path.join(directory, name + '.wav'), duration, sr=sr, seed=seed + i)
+    with open(manifest_path, 'w') as f:
+        json.dump({'config': config, 'transitions': transitions}, f, indent=1)
+    return transitions
@@ -0,0 +1,401 @@
+import os
+import json
+import time
+import hashlib
+import tempfile
+import threading
+import contextlib
+import queue
+from functools import partial
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, as_completed
+import numpy as np
+import utils
+import windowing
+import feature_format
+import instrument
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+cache_dir = 'features'
+manifest_name = 'manifest.json'
+max_cache_bytes = 20 * 1024 ** 3
+cache_version = 1
+default_params = {'sr': 22050, 'n_mfcc': 13, 'hop_length': 512}
+# Decode block length; streaming output matches whole-file extraction, so it is not part of the key
+stream_block_seconds = 300
+lock_name = 'manifest.lock'
+# Last-access times only order eviction, so a hit refreshes them at this granularity instead of rewriting the manifest every time
+access_resolution = 3600
+# Entries a batch run in this process has handed out paths for and will still read; eviction leaves them alone
+pinned_keys = set()
+# Serializes manifest read-modify-write cycles between threads of one process
+manifest_lock = threading.RLock()
+manifest_lock_depth = 0
+
+@contextlib.contextmanager
+def locked_manifest(directory=cache_dir):
+    # The thread lock covers this process; a lock file next to the manifest covers prefetch and extraction processes
+    global manifest_lock_depth
+    with manifest_lock:
+        if manifest_lock_depth or fcntl is None:
+            manifest_lock_depth += 1
+            try:
+                yield
+            finally:
+                manifest_lock_depth -= 1
+            return
+        os.makedirs(directory, exist_ok=True)
+        with open(os.path.join(directory, lock_name), 'a') as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            manifest_lock_depth += 1
+            try:
+                yield
+            finally:
+                manifest_lock_depth -= 1
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+def file_hash(path, chunk_size=1 << 20):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+def feature_key(audio_hash, params):
+    payload = json.dumps({'version': cache_version, 'audio': audio_hash, 'params': params}, sort_keys=True)
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()[:32]
+
+def resolve_params(params):
+    resolved = dict(default_params)
+    resolved.update(params)
+    return resolved
+
+def load_manifest(directory=cache_dir):
+    manifest_path = os.path.join(directory, manifest_name)
+    try:
+        with open(manifest_path, 'r') as f:
+            manifest = json.load(f)
+    except (FileNotFoundError, json.JSONDecodeError):
+        manifest = {}
+    if manifest.get('version') != cache_version:
+        manifest = {'version': cache_version, 'entries': {}, 'sources': {}}
+    return manifest
+
+def save_manifest(manifest, directory=cache_dir):
+    manifest_path = os.path.join(directory, manifest_name)
+    fd, tmp_path = tempfile.mkstemp(dir=directory, prefix='.manifest-', suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'w') as f:
+            json.dump(manifest, f, indent=1, sort_keys=True)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, manifest_path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+def atomic_save(path, array, storage='float32'):
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), prefix='.feat-', suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            if storage == 'float32':
+                np.save(f, array)
+            else:
+                feature_format.write(f, array, storage)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+def get_audio_hash(audio_path, manifest):
+    # Re-hash only when size or mtime changed since the last run
+    source_key = os.path.abspath(audio_path)
+    stat = os.stat(audio_path)
+    source = manifest['sources'].get(source_key)
+    if source and source['size'] == stat.st_size and source['mtime'] == stat.st_mtime_ns:
+        return source['hash']
+    audio_hash = file_hash(audio_path)
+    manifest['sources'][source_key] = {'size': stat.st_size, 'mtime': stat.st_mtime_ns, 'hash': audio_hash}
+    return audio_hash
+
+def entry_path(key, directory=cache_dir, entry=None):
+    return os.path.join(directory, entry.get('file', key + '.npy') if entry else key + '.npy')
+
+def read_features(path, mmap_mode=None):
+    if path.endswith('.npy'):
+        return np.load(path, mmap_mode=mmap_mode)
+    return feature_format.read(path, mmap_mode=mmap_mode)
+
+def set_storage_format(storage, directory=cache_dir):
+    # Applies to features extracted from now on; existing entries keep their format
+    if storage not in feature_format.storage_formats:
+        raise ValueError(f"Unknown feature storage format {storage}")
+    os.makedirs(directory, exist_ok=True)
+    with locked_manifest(directory):
+        manifest = load_manifest(directory)
+        manifest['storage'] = storage
+        save_manifest(manifest, directory)
+
+def lookup_entry(manifest, key, directory=cache_dir):
+    # (path or None on a miss, whether the manifest changed)
+    entry = manifest['entries'].get(key)
+    path = entry_path(key, directory, entry)
+    if entry is None or not os.path.exists(path):
+        return None, manifest['entries'].pop(key, None) is not None
+    now = time.time()
+    if now - entry['last_access'] < access_resolution:
+        return path, False
+    entry['last_access'] = now
+    return path, True
+
+def store_entry(manifest, key, array, directory=cache_dir, storage='float32', **metadata):
+    file_name = key + ('.npy' if storage == 'float32' else '.mfq')
+    path = os.path.join(directory, file_name)
+    atomic_save(path, array, storage)
+    manifest['entries'][key] = dict(metadata, **{
+        'file': file_name,
+        'storage': storage,
+        'shape': list(array.shape),
+        'dtype': str(array.dtype),
+        'size': os.path.getsize(path),
+        'created': time.time(),
+        'last_access': time.time(),
+    })
+    evict(manifest, directory, keep=key)
+    return path
+
+def lookup_many(audio_paths, directory=cache_dir, **params):
+    # {audio path: (key, path or None)} from one manifest load, saved once and only if something changed
+    os.makedirs(directory, exist_ok=True)
+    params = resolve_params(params)
+    found = {}
+    changed = False
+    with locked_manifest(directory):
+        manifest = load_manifest(directory)
+        for audio_path in audio_paths:
+            source = manifest['sources'].get(os.path.abspath(audio_path))
+            key = feature_key(get_audio_hash(audio_path, manifest), params)
+            path, touched = lookup_entry(manifest, key, directory)
+            changed = changed or touched or manifest['sources'].get(os.path.abspath(audio_path)) is not source
+            found[audio_path] = (key, path)
+        if changed:
+            save_manifest(manifest, directory)
+    return found
+
+def lookup(audio_path, directory=cache_dir, **params):
+    return lookup_many([audio_path], directory, **params)[audio_path][1]
+
+def store(audio_path, features, directory=cache_dir, **params):
+    os.makedirs(directory, exist_ok=True)
+    params = resolve_params(params)
+    with locked_manifest(directory):
+        manifest = load_manifest(directory)
+        key = feature_key(get_audio_hash(audio_path, manifest), params)
+        path = store_entry(manifest, key, features, directory, storage=manifest.get('storage', 'float32'), source=os.path.basename(audio_path), params=params)
+        save_manifest(manifest, directory)
+        return path
+
+def evict(manifest, directory=cache_dir, max_bytes=None, keep=None):
+    if max_bytes is None:
+        max_bytes = max_cache_bytes
+    entries = manifest['entries']
+    total = sum(entry['size'] for entry in entries.values())
+    for key in sorted(entries, key=lambda k: entries[k]['last_access']):
+        if total <= max_bytes:
+            break
+        if key == keep or key in pinned_keys:
+            continue
+        path = entry_path(key, directory, entries[key])
+        if os.path.exists(path):
+            os.remove(path)
+        total -= entries.pop(key)['size']
+
+def timed_feature_path(audio_path, directory=cache_dir, **params):
+    start = time.perf_counter()
+    path = lookup(audio_path, directory, **params)
+    timings = {'cache_hit': path is not None, 'lookup': time.perf_counter() - start}
+    if path is None:
+        features, extract_timings = extract_worker(audio_path, resolve_params(params), stream_block_seconds)
+        timings.update(extract_timings)
+        store_start = time.perf_counter()
+        path = store(audio_path, features, directory, **params)
+        timings['store'] = time.perf_counter() - store_start
+    return path, timings
+
+def get_feature_path(audio_path, directory=cache_dir, **params):
+    path, timings = timed_feature_path(audio_path, directory, **params)
+    instrument.current.record_file(audio_path, **timings)
+    return path
+
+def load_features(audio_path, directory=cache_dir, mmap_mode=None, **params):
+    return read_features(get_feature_path(audio_path, directory, **params), mmap_mode=mmap_mode)
+
+def weights_hash(model):
+    arrays = model.get_weights() if hasattr(model, 'get_weights') else [model.weights[name] for name in sorted(model.weights)]
+    # Digests are sorted, so a Keras model and its NumPy export share one hash
+    digests = sorted(hashlib.sha256(np.ascontiguousarray(array, dtype=np.float32).tobytes()).hexdigest() for array in arrays)
+    return hashlib.sha256(''.join(digests).encode('utf-8')).hexdigest()
+
+def get_probabilities(audio_path, classification_model, window_frames, hop_frames=None, directory=cache_dir, model_hash=None, **params):
+    # Per-window classification scores, kept next to the features until the model or the features change
+    params = resolve_params(params)
+    hop_frames = hop_frames or window_frames
+    model_hash = model_hash or weights_hash(classification_model)
+    os.makedirs(directory, exist_ok=True)
+    with locked_manifest(directory):
+        manifest = load_manifest(directory)
+        source = manifest['sources'].get(os.path.abspath(audio_path))
+        key = f"{feature_key(get_audio_hash(audio_path, manifest), params)}-p{model_hash[:16]}-{window_frames}x{hop_frames}"
+        path, changed = lookup_entry(manifest, key, directory)
+        if changed or manifest['sources'].get(os.path.abspath(audio_path)) is not source:
+            save_manifest(manifest, directory)
+    instrument.current.record_file(audio_path, probabilities_cached=path is not None)
+    if path is not None:
+        return np.load(path)
+    features = load_features(audio_path, directory, mmap_mode='r', **params)
+    windows = windowing.frame_windows(features, window_frames, hop_frames)
+    probabilities = np.zeros(0, dtype=np.float32)
+    if len(windows):
+        probabilities = np.asarray(classification_model.predict(windows, verbose=0), dtype=np.float32).flatten()
+    with locked_manifest(directory):
+        manifest = load_manifest(directory)
+        store_entry(manifest, key, probabilities, directory, source=os.path.basename(audio_path), params=params, model=model_hash,
+                    window_frames=window_frames, hop_frames=hop_frames)
+        save_manifest(manifest, directory)
+    return probabilities
+
+def drop_probabilities(directory=cache_dir):
+    with locked_manifest(directory):
+        manifest = load_manifest(directory)
+        for key in [key for key, entry in manifest['entries'].items() if 'model' in entry]:
+            path = entry_path(key, directory, manifest['entries'][key])
+            if os.path.exists(path):
+                os.remove(path)
+            del manifest['entries'][key]
+        save_manifest(manifest, directory)
+
+def extract_worker(audio_path, params, block_seconds):
+    start = time.perf_counter()
+    timings = {}
+    features = utils.extract_features(audio_path, block_seconds=block_seconds, timings=timings, **params)
+    timings['extract'] = time.perf_counter() - start
+    timings['frames'] = features.shape[0]
+    return features, timings
+
+def extract_all(audio_paths, directory=cache_dir, workers=None, **params):
+    params = resolve_params(params)
+    feature_paths = {}
+    pending = []
+    found = lookup_many(audio_paths, directory, **params)
+    # Storing the later files must not evict the earlier ones before training reads them
+    pinned_keys.update(key for key, _ in found.values())
+    for audio_path, (key, path) in found.items():
+        instrument.current.record_file(audio_path, cache_hit=path is not None)
+        if path is None:
+            pending.append(audio_path)
+        else:
+            feature_paths[audio_path] = path
+    if pending:
+        workers = min(workers or os.cpu_count() or 1, len(pending))
+        print(f"{len(feature_paths)} cached, extracting {len(pending)} files with {workers} workers")
+        start = time.perf_counter()
+        # Spawned workers avoid forking a parent that may already hold TensorFlow threads
+        context = multiprocessing.get_context('spawn')
+        with ProcessPoolExecutor(max_workers=workers, mp_context=context) as executor:
+            futures = {executor.submit(extract_worker, audio_path, params, stream_block_seconds): audio_path for audio_path in pending}
+            for done, future in enumerate(as_completed(futures), 1):
+                audio_path = futures[future]
+                name = os.path.basename(audio_path)
+                try:
+                    features, timings = future.result()
+                except Exception as e:
+                    print(f"[{done}/{len(pending)}] Failed to extract {name}: {e!r}")
+                    continue
+                feature_paths[audio_path] = store(audio_path, features, directory, **params)
+                instrument.current.record_file(audio_path, **timings)
+                print(f"[{done}/{len(pending)}] {name}: {features.shape[0]} frames in {timings['extract']:.1f}s")
+        print(f"Extraction finished in {time.perf_counter() - start:.1f}s")
+    return {audio_path: feature_paths[audio_path] for audio_path in audio_paths if audio_path in feature_paths}
+
+class ExtractionQueue:
+    def __init__(self, directory=cache_dir, workers=None, max_pending=4, **params):
+        self.directory = directory
+        self.params = resolve_params(params)
+        workers = workers or os.cpu_count() or 1
+        self.pending = queue.Queue(maxsize=max_pending)
+        # Bounds in-flight extractions so a full queue really pushes back on the producer
+        self.slots = threading.Semaphore(workers)
+        self.executor = ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context('spawn'))
+        # Finished extractions, stored by the writer thread; done-callbacks run on the pool's manager thread and must not block it
+        self.finished = queue.Queue()
+        self.feature_paths = {}
+        self.failed = []
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+        self.writer = threading.Thread(target=self.write, daemon=True)
+        self.writer.start()
+
+    def put(self, audio_path):
+        self.pending.put(audio_path)
+
+    def run(self):
+        while True:
+            audio_path = self.pending.get()
+            if audio_path is None:
+                break
+            # One bad file or a broken pool fails that item only; the thread keeps draining the queue
+            try:
+                key, path = lookup_many([audio_path], self.directory, **self.params)[audio_path]
+                pinned_keys.add(key)
+            except Exception as e:
+                print(f"Failed to look up {os.path.basename(audio_path)}: {e!r}")
+                self.failed.append(audio_path)
+                continue
+            if path is not None:
+                self.feature_paths[audio_path] = path
+                continue
+            self.slots.acquire()
+            try:
+                future = self.executor.submit(extract_worker, audio_path, self.params, stream_block_seconds)
+            except Exception as e:
+                print(f"Failed to extract {os.path.basename(audio_path)}: {e!r}")
+                self.failed.append(audio_path)
+                self.slots.release()
+                continue
+            future.add_done_callback(partial(self.finish, audio_path))
+
+    def finish(self, audio_path, future):
+        self.finished.put((audio_path, future))
+
+    def write(self):
+        while True:
+            item = self.finished.get()
+            if item is None:
+                break
+            audio_path, future = item
+            name = os.path.basename(audio_path)
+            try:
+                features, timings = future.result()
+                self.feature_paths[audio_path] = store(audio_path, features, self.directory, **self.params)
+                print(f"Features ready: {name} ({features.shape[0]} frames in {timings['extract']:.1f}s)")
+            except Exception as e:
+                print(f"Failed to extract {name}: {e!r}")
+                self.failed.append(audio_path)
+            finally:
+                self.slots.release()
+
+    def close(self):
+        self.pending.put(None)
+        self.thread.join()
+        self.executor.shutdown(wait=True)
+        # Every done-callback has run once the pool is shut down, so this is the last item the writer sees
+        self.finished.put(None)
+        self.writer.join()
+        return self.feature_paths
@@ -0,0 +1,107 @@
+import json
+import struct
+import numpy as np
+
+magic = b'MFCQ'
+format_version = 1
+storage_formats = ('float32', 'float16', 'int8')
+# Frames sharing one int8 scale and offset per coefficient
+chunk_frames = 4096
+alignment = 64
+int8_levels = 254
+
+def quantize(features, storage, chunk=chunk_frames):
+    features = np.asarray(features, dtype=np.float32)
+    num_chunks = max(-(-len(features) // chunk), 1)
+    scales = np.ones((num_chunks, features.shape[1]), dtype=np.float32)
+    offsets = np.zeros((num_chunks, features.shape[1]), dtype=np.float32)
+    if storage != 'int8':
+        return features.astype(storage), scales, offsets
+    payload = np.empty(features.shape, dtype=np.int8)
+    for i in range(0, len(features), chunk):
+        block = features[i:i + chunk]
+        low, high = block.min(axis=0), block.max(axis=0)
+        scale = np.where(high > low, (high - low) / int8_levels, 1).astype(np.float32)
+        scales[i // chunk], offsets[i // chunk] = scale, low
+        payload[i:i + chunk] = np.round((block - low) / scale) - int8_levels // 2
+    return payload, scales, offsets
+
+def write(f, features, storage='int8', chunk=chunk_frames):
+    payload, scales, offsets = quantize(features, storage, chunk)
+    header = {'version': format_version, 'storage': storage, 'frames': int(payload.shape[0]), 'coefficients': int(payload.shape[1]),
+              'chunk_frames': chunk, 'chunks': int(scales.shape[0])}
+    header_bytes = json.dumps(header).encode('utf-8')
+    prefix = len(magic) + 4 + len(header_bytes)
+    # The frame payload starts on an aligned offset so it can be memory-mapped directly
+    scales_offset = -(-prefix // alignment) * alignment
+    data_offset = -(-(scales_offset + scales.nbytes + offsets.nbytes) // alignment) * alignment
+    f.write(magic + struct.pack('<I', len(header_bytes)) + header_bytes)
+    f.write(b'\0' * (scales_offset - prefix))
+    f.write(scales.tobytes())
+    f.write(offsets.tobytes())
+    f.write(b'\0' * (data_offset - scales_offset - scales.nbytes - offsets.nbytes))
+    f.write(np.ascontiguousarray(payload).tobytes())
+
+class QuantizedFeatures:
+    def __init__(self, path):
+        with open(path, 'rb') as f:
+            if f.read(len(magic)) != magic:
+                raise ValueError(f"{path} is not a feature file")
+            header_length = struct.unpack('<I', f.read(4))[0]
+            header = json.loads(f.read(header_length))
+        if header.get('version') != format_version:
+            raise ValueError(f"{path} was written with an unsupported format, please extract it again")
+        self.path = path
+        self.storage = header['storage']
+        self.chunk_frames = header['chunk_frames']
+        self.shape = (header['frames'], header['coefficients'])
+        prefix = len(magic) + 4 + header_length
+        scales_offset = -(-prefix // alignment) * alignment
+        table = np.fromfile(path, dtype=np.float32, count=2 * header['chunks'] * header['coefficients'], offset=scales_offset)
+        self.scales, self.offsets = table.reshape(2, header['chunks'], header['coefficients'])
+        data_offset = -(-(scales_offset + table.nbytes) // alignment) * alignment
+        self.data = np.memmap(path, dtype=self.storage, mode='r', offset=data_offset, shape=self.shape) if self.shape[0] else np.empty(self.shape, dtype=self.storage)
+
+    ndim = 2
+    dtype = np.dtype(np.float32)
+
+    def __len__(self):
+        return self.shape[0]
+
+    def __getitem__(self, key):
+        if isinstance(key, (int, np.integer)):
+            key = int(key) + len(self) if key < 0 else int(key)
+            return self[key:key + 1][0]
+        if not isinstance(key, slice) or key.step not in (None, 1):
+            return np.asarray(self)[key]
+        # Only the requested frames are read and dequantized
+        start, stop, _ = key.indices(len(self))
+        raw = self.data[start:max(start, stop)]
+        if self.storage != 'int8':
+            return raw.astype(np.float32)
+        chunks = np.arange(start, start + len(raw)) // self.chunk_frames
+        return (raw.astype(np.float32) + int8_levels // 2) * self.scales[chunks] + self.offsets[chunks]
+
+    def __array__(self, dtype=None, copy=None):
+        features = self[:]
+        return features if dtype is None else features.astype(dtype)
+
+def read(path, mmap_mode=None):
+    features = QuantizedFeatures(path)
+    return features if mmap_mode else np.asarray(features)
+
+def drift(features, storage, chunk=chunk_frames):
+    # Round-trip error of a storage format against the float32 frames
+    features = np.asarray(features, dtype=np.float32)
+    payload, scales, offsets = quantize(features, storage, chunk)
+    restored = payload.astype(np.float32)
+    if storage == 'int8':
+        chunks = np.arange(len(features)) // chunk
+        restored = (restored + int8_levels // 2) * scales[chunks] + offsets[chunks]
+    error = np.abs(restored - features)
+    return {
+        'bytes_per_frame': payload.itemsize * features.shape[1],
+        'max_abs_error': float(error.max()) if error.size else 0.0,
+        'rms_error': float(np.sqrt(np.mean(error ** 2))) if error.size else 0.0,
+        'relative_rms_error': float(np.sqrt(np.mean(error ** 2)) / max(float(features.std()), 1e-12)) if error.size else 0.0,
+    }, restored
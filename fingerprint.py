@@ -0,0 +1,154 @@
+import os
+import json
+import numpy as np
+import windowing
+
+index_path = os.path.join('models', 'fingerprints.npz')
+format_version = 1
+embed_seconds = 2.0
+hop_frames = 4
+num_tables = 8
+num_bits = 16
+# Buckets this crowded (silence, steady tones) say little about identity and are skipped
+max_bucket = 256
+similarity_threshold = 0.9
+min_match_seconds = 4.0
+
+def window_embeddings(features, window_frames, step=hop_frames):
+    # Mean and spread of each coefficient per window, from running sums so the cost is linear in frames
+    num_windows = windowing.count_windows(len(features), window_frames, step)
+    if num_windows == 0:
+        return np.empty((0, 2 * features.shape[1] - 1), dtype=np.float32), np.empty(0, dtype=np.int64)
+    x = np.asarray(features, dtype=np.float64)
+    sums = np.concatenate([np.zeros((1, x.shape[1])), np.cumsum(x, axis=0)])
+    squares = np.concatenate([np.zeros((1, x.shape[1])), np.cumsum(x * x, axis=0)])
+    starts = np.arange(num_windows, dtype=np.int64) * step
+    mean = (sums[starts + window_frames] - sums[starts]) / window_frames
+    variance = (squares[starts + window_frames] - squares[starts]) / window_frames - mean * mean
+    # The mean of the first coefficient follows loudness, which changes between broadcasts of the same spot
+    embeddings = np.concatenate([mean[:, 1:], np.sqrt(np.maximum(variance, 0))], axis=1)
+    return embeddings.astype(np.float32), starts
+
+def normalize(embeddings, center):
+    centered = embeddings - center
+    return centered / np.maximum(np.linalg.norm(centered, axis=1, keepdims=True), 1e-9)
+
+class FingerprintIndex:
+    def __init__(self, embeddings, spot_ids, offsets, spots, planes, center, params):
+        self.embeddings = embeddings
+        self.spot_ids = spot_ids
+        self.offsets = offsets
+        self.spots = spots
+        self.planes = planes
+        self.center = center
+        self.params = params
+        self.window_frames = windowing.seconds_to_frames(embed_seconds, params['sr'], params['hop_length'])
+        codes = self.hash(embeddings)
+        self.order = np.argsort(codes, axis=0, kind='stable')
+        self.sorted_codes = np.take_along_axis(codes, self.order, axis=0)
+
+    def hash(self, embeddings):
+        # Random hyperplane signs, num_bits of them packed into one code per table
+        bits = (embeddings @ self.planes.reshape(self.planes.shape[0], -1)).reshape(len(embeddings), num_tables, num_bits) > 0
+        return (bits * (1 << np.arange(num_bits, dtype=np.int64))).sum(axis=2)
+
+    def candidates(self, queries):
+        codes = self.hash(queries)
+        pairs = []
+        for table in range(num_tables):
+            left = np.searchsorted(self.sorted_codes[:, table], codes[:, table], side='left')
+            right = np.searchsorted(self.sorted_codes[:, table], codes[:, table], side='right')
+            sizes = right - left
+            sizes[sizes > max_bucket] = 0
+            query_ids = np.repeat(np.arange(len(queries)), sizes)
+            # Position of every candidate inside the sorted table, without a Python loop over queries
+            positions = np.arange(sizes.sum()) - np.repeat(np.cumsum(sizes) - sizes, sizes) + np.repeat(left, sizes)
+            pairs.append(query_ids * len(self.embeddings) + self.order[positions, table])
+        pairs = np.unique(np.concatenate(pairs))
+        return pairs // len(self.embeddings), pairs % len(self.embeddings)
+
+    def match(self, features):
+        queries, query_starts = window_embeddings(features, self.window_frames)
+        if len(queries) == 0 or len(self.embeddings) == 0:
+            return []
+        queries = normalize(queries, self.center)
+        query_ids, index_ids = self.candidates(queries)
+        similarity = np.einsum('ij,ij->i', queries[query_ids], self.embeddings[index_ids])
+        keep = similarity >= similarity_threshold
+        query_ids, index_ids, similarity = query_ids[keep], index_ids[keep], similarity[keep]
+        if len(query_ids) == 0:
+            return []
+        # Windows of one repeat agree on where the spot would start in this episode
+        spot_ids = self.spot_ids[index_ids]
+        aligned = query_starts[query_ids] - self.offsets[index_ids]
+        bins = np.floor_divide(aligned, 2 * hop_frames)
+        keys, inverse, votes = np.unique(np.stack([spot_ids, bins], axis=1), axis=0, return_inverse=True, return_counts=True)
+        by_key = np.argsort(inverse.ravel(), kind='stable')
+        bounds = np.concatenate([[0], np.cumsum(votes)])
+        frame_seconds = self.params['hop_length'] / self.params['sr']
+        min_votes = min_match_seconds / (hop_frames * frame_seconds)
+        # Keys come sorted by spot then alignment; neighbouring alignments are one repeat split by frame jitter
+        clusters = []
+        for k in range(len(keys)):
+            members = by_key[bounds[k]:bounds[k + 1]]
+            if clusters and clusters[-1]['spot'] == keys[k, 0] and keys[k, 1] - clusters[-1]['bin'] <= 1:
+                clusters[-1]['members'].append(members)
+                clusters[-1]['bin'] = keys[k, 1]
+            else:
+                clusters.append({'spot': keys[k, 0], 'bin': keys[k, 1], 'members': [members]})
+        matches = []
+        for cluster in clusters:
+            members = np.concatenate(cluster['members'])
+            matched_windows = len(np.unique(query_ids[members]))
+            if matched_windows < min_votes:
+                continue
+            spot = self.spots[cluster['spot']]
+            first = query_starts[query_ids[members]].min()
+            last = query_starts[query_ids[members]].max() + self.window_frames
+            matches.append({
+                'start': float(first * frame_seconds),
+                'end': float(last * frame_seconds),
+                'source': spot['source'],
+                'source_start': float(spot['start'] + self.offsets[index_ids[members]].min() * frame_seconds),
+                'similarity': float(similarity[members].mean()),
+            })
+        return sorted(matches, key=lambda m: m['start'])
+
+def build_index(entries, sr=22050, hop_length=512, seed=0):
+    # entries: (source name, frame features, [(start, end) seconds]) for every labeled file
+    window_frames = windowing.seconds_to_frames(embed_seconds, sr, hop_length)
+    embeddings, spot_ids, offsets, spots = [], [], [], []
+    for source, features, ranges in entries:
+        for start, end in ranges:
+            first = windowing.time_to_frame(start, sr, hop_length)
+            last = min(windowing.time_to_frame(end, sr, hop_length), len(features))
+            spot_embeddings, starts = window_embeddings(features[first:last], window_frames)
+            if len(spot_embeddings) == 0:
+                continue
+            embeddings.append(spot_embeddings)
+            spot_ids.append(np.full(len(starts), len(spots), dtype=np.int64))
+            offsets.append(starts)
+            spots.append({'source': source, 'start': first * hop_length / sr, 'end': last * hop_length / sr})
+    dims = 2 * entries[0][1].shape[1] - 1 if entries else 0
+    if not embeddings:
+        return FingerprintIndex(np.empty((0, dims), dtype=np.float32), np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int64), [],
+                                np.zeros((dims, num_tables, num_bits), dtype=np.float32), np.zeros(dims, dtype=np.float32), {'sr': sr, 'hop_length': hop_length})
+    embeddings = np.concatenate(embeddings)
+    center = embeddings.mean(axis=0)
+    planes = np.random.default_rng(seed).standard_normal((embeddings.shape[1], num_tables, num_bits)).astype(np.float32)
+    return FingerprintIndex(normalize(embeddings, center).astype(np.float32), np.concatenate(spot_ids), np.concatenate(offsets), spots,
+                            planes, center.astype(np.float32), {'sr': sr, 'hop_length': hop_length})
+
+def save_index(index, path=index_path):
+    header = json.dumps({'version': format_version, 'params': index.params, 'spots': index.spots})
+    # Unit vectors lose nothing that matters for a 0.9 cosine threshold in half precision
+    np.savez(path, header=np.array(header), embeddings=index.embeddings.astype(np.float16), spot_ids=index.spot_ids.astype(np.int32),
+             offsets=index.offsets.astype(np.int32), planes=index.planes, center=index.center)
+
+def load_index(path=index_path):
+    with np.load(path) as archive:
+        header = json.loads(str(archive['header']))
+        if header.get('version') != format_version:
+            raise ValueError(f"{path} was built with an unsupported format, please build it again")
+        return FingerprintIndex(archive['embeddings'].astype(np.float32), archive['spot_ids'].astype(np.int64), archive['offsets'].astype(np.int64),
+                                header['spots'], archive['planes'], archive['center'], header['params'])
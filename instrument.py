@@ -0,0 +1,143 @@
+import os
+import json
+import time
+import math
+import threading
+import contextlib
+
+# Keras predict splits a call into steps of this many samples unless told otherwise
+keras_batch_size = 32
+
+class RunReport:
+    def __init__(self, mode=None, enabled=True):
+        self.mode = mode
+        self.enabled = enabled
+        self.started = time.time()
+        self.clock = time.perf_counter()
+        self.stages = {}
+        self.counters = {}
+        self.files = {}
+        self.predicts = {}
+        self.lock = threading.Lock()
+
+    @contextlib.contextmanager
+    def stage(self, name):
+        if not self.enabled:
+            yield
+            return
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - start
+            with self.lock:
+                stage = self.stages.setdefault(name, {'seconds': 0.0, 'calls': 0})
+                stage['seconds'] += elapsed
+                stage['calls'] += 1
+
+    def count(self, name, amount=1):
+        if not self.enabled:
+            return
+        with self.lock:
+            self.counters[name] = self.counters.get(name, 0) + amount
+
+    def record_file(self, path, **values):
+        if not self.enabled:
+            return
+        with self.lock:
+            self.files.setdefault(os.path.basename(path), {}).update(values)
+
+    def record_predict(self, name, samples, seconds, batch_size=None):
+        if not self.enabled:
+            return
+        with self.lock:
+            predict = self.predicts.setdefault(name, {'calls': 0, 'samples': 0, 'steps': 0, 'seconds': 0.0, 'call_sizes': {}})
+            predict['calls'] += 1
+            predict['samples'] += samples
+            predict['steps'] += math.ceil(samples / (batch_size or keras_batch_size))
+            predict['seconds'] += seconds
+            predict['call_sizes'][str(samples)] = predict['call_sizes'].get(str(samples), 0) + 1
+
+    def to_dict(self):
+        elapsed = time.perf_counter() - self.clock
+        files = self.files.values()
+        throughput = {}
+        if elapsed > 0 and 'frames' in self.counters:
+            throughput['frames_per_second'] = self.counters['frames'] / elapsed
+        classification = self.predicts.get('classification')
+        if classification and classification['seconds'] > 0:
+            throughput['windows_per_predict_second'] = classification['samples'] / classification['seconds']
+        return {
+            'mode': self.mode,
+            'started': time.strftime('%Y-%m-%dT%H:%M:%S', time.localtime(self.started)),
+            'seconds': elapsed,
+            'stages': self.stages,
+            'counters': self.counters,
+            'cache': {
+                'hits': sum(1 for record in files if record.get('cache_hit')),
+                'misses': sum(1 for record in files if record.get('cache_hit') is False),
+            },
+            'throughput': throughput,
+            'predict': self.predicts,
+            'files': self.files,
+        }
+
+    def write(self, path):
+        with open(path, 'w') as f:
+            json.dump(self.to_dict(), f, indent=1)
+        return path
+
+class InstrumentedModel:
+    def __init__(self, model, name, report):
+        self.model = model
+        self.name = name
+        self.report = report
+
+    def predict(self, x, *args, **kwargs):
+        start = time.perf_counter()
+        result = self.model.predict(x, *args, **kwargs)
+        self.report.record_predict(self.name, len(x), time.perf_counter() - start, kwargs.get('batch_size'))
+        return result
+
+    def __getattr__(self, name):
+        return getattr(self.model, name)
+
+# Disabled until a run asks for a report, so instrumented code costs next to nothing by default
+current = RunReport(enabled=False)
+
+def start(mode):
+    global current
+    current = RunReport(mode)
+    return current
+
+def stop():
+    global current
+    report = current
+    current = RunReport(enabled=False)
+    return report
+
+def stage(name):
+    return current.stage(name)
+
+def count(name, amount=1):
+    current.count(name, amount)
+
+def wrap_model(model, name):
+    if not current.enabled or model is None:
+        return model
+    return InstrumentedModel(model, name, current)
+
+@contextlib.contextmanager
+def profiled(path):
+    if not path:
+        yield
+        return
+    import cProfile
+    profile = cProfile.Profile()
+    profile.enable()
+    try:
+        yield
+    finally:
+        profile.disable()
+        profile.dump_stats(path)
+        print(f"Profile written to {path}")
@@ -0,0 +1,94 @@
+import os
+import time
+import sqlite3
+import utils
+
+store_path = os.path.join('input', 'labels.db')
+
+schema = """
+CREATE TABLE IF NOT EXISTS sessions (
+    id INTEGER PRIMARY KEY,
+    basename TEXT NOT NULL,
+    source TEXT NOT NULL,
+    created REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS ranges (
+    session INTEGER NOT NULL REFERENCES sessions(id) ON DELETE CASCADE,
+    basename TEXT NOT NULL,
+    label TEXT NOT NULL,
+    start REAL NOT NULL,
+    end REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS imports (
+    source TEXT PRIMARY KEY,
+    mtime REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS sessions_basename ON sessions(basename);
+CREATE INDEX IF NOT EXISTS ranges_basename ON ranges(basename, label, start);
+"""
+
+def connect(path=store_path):
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    connection = sqlite3.connect(path)
+    connection.execute('PRAGMA foreign_keys = ON')
+    connection.executescript(schema)
+    return connection
+
+def insert_session(connection, basename, ranges, label, source):
+    session = connection.execute('INSERT INTO sessions (basename, source, created) VALUES (?, ?, ?)',
+                                 (basename, source, time.time())).lastrowid
+    connection.executemany('INSERT INTO ranges (session, basename, label, start, end) VALUES (?, ?, ?, ?, ?)',
+                           [(session, basename, label, float(start), float(end)) for start, end in ranges])
+    return session
+
+def add_session(connection, basename, ranges, label='A', source='', replace=False):
+    # Sessions append; overlapping ranges of the same label are merged when read back
+    basename = os.path.basename(basename)
+    with connection:
+        if replace:
+            connection.execute('DELETE FROM sessions WHERE basename = ?', (basename,))
+        return insert_session(connection, basename, ranges, label, source)
+
+def merge_ranges(ranges):
+    merged = []
+    for start, end in sorted(ranges):
+        if merged and start <= merged[-1][1]:
+            merged[-1] = (merged[-1][0], max(merged[-1][1], end))
+        else:
+            merged.append((start, end))
+    return merged
+
+def get_ranges(connection, basename, label='A'):
+    rows = connection.execute('SELECT start, end FROM ranges WHERE basename = ? AND label = ? ORDER BY start',
+                              (os.path.basename(basename), label)).fetchall()
+    return merge_ranges(rows)
+
+def labeled_basenames(connection):
+    return [row[0] for row in connection.execute('SELECT DISTINCT basename FROM sessions ORDER BY basename')]
+
+def load_ranges(connection, label='A'):
+    # Files labeled without any range of this label still appear, with no ranges
+    ranges = {basename: [] for basename in labeled_basenames(connection)}
+    for basename, start, end in connection.execute('SELECT basename, start, end FROM ranges WHERE label = ?', (label,)):
+        ranges[basename].append((start, end))
+    return {basename: merge_ranges(file_ranges) for basename, file_ranges in ranges.items()}
+
+def load_split_points(connection, label='A'):
+    return {basename: [(start + end) / 2 for start, end in file_ranges] for basename, file_ranges in load_ranges(connection, label).items()}
+
+def import_segments_file(connection, segments_file_path, label='A'):
+    # Re-importing a text file replaces the sessions it produced before, so edits to it are picked up
+    source = os.path.abspath(segments_file_path)
+    mtime = os.path.getmtime(segments_file_path)
+    row = connection.execute('SELECT mtime FROM imports WHERE source = ?', (source,)).fetchone()
+    if row and row[0] == mtime:
+        return 0
+    file_ranges = utils.parse_segments_ranges(segments_file_path)
+    with connection:
+        connection.execute('DELETE FROM sessions WHERE source = ?', (source,))
+        for basename, ranges in file_ranges.items():
+            insert_session(connection, basename, ranges, label, source)
+        connection.execute('INSERT OR REPLACE INTO imports (source, mtime) VALUES (?, ?)', (source, mtime))
+    return len(file_ranges)
@@ -0,0 +1,151 @@
+import os
+import sys
+import time
+import numpy as np
+import streaming
+import windowing
+
+class StreamingDetector:
+    def __init__(self, classification_model, regression_model, sr=22050, hop_length=512, n_mfcc=13,
+                 window_size=30, regression_window_size=180, threshold=0.5, top_db=80.0):
+        self.classification_model = classification_model
+        self.regression_model = regression_model
+        self.sr = sr
+        self.hop_length = hop_length
+        self.n_mfcc = n_mfcc
+        self.window_size = window_size
+        self.regression_window_size = regression_window_size
+        self.threshold = threshold
+        self.top_db = top_db
+        self.mel = streaming.MelStream(sr=sr, hop_length=hop_length)
+        self.peak_db = -np.inf
+        self.window_frames = windowing.seconds_to_frames(window_size, sr, hop_length)
+        self.regression_frames = windowing.seconds_to_frames(regression_window_size, sr, hop_length)
+        # Enough history for a regression window centered on the oldest undecided classification window
+        self.history_frames = self.regression_frames + 3 * self.window_frames
+        self.frames = np.zeros((0, n_mfcc), dtype=np.float32)
+        self.frame_offset = 0
+        self.scores = []
+        self.candidates = []
+
+    @property
+    def total_frames(self):
+        return self.frame_offset + len(self.frames)
+
+    def push(self, samples):
+        return self.add_mel(self.mel.push(samples))
+
+    def finish(self):
+        emitted = self.add_mel(self.mel.flush())
+        # The last scored window has no successor, so judge it against its predecessor only
+        if self.scores and self.is_peak(len(self.scores) - 1, final=True):
+            self.candidates.append(self.midpoint(len(self.scores) - 1))
+        return emitted + self.regress(self.candidates, final=True)
+
+    def add_mel(self, mel_db):
+        if len(mel_db) == 0:
+            return []
+        # The top_db floor follows the running peak, since the global peak of a live stream is unknown
+        self.peak_db = max(self.peak_db, float(mel_db.max()))
+        mfcc = streaming.mel_to_mfcc(mel_db, n_mfcc=self.n_mfcc, floor_db=self.peak_db - self.top_db).astype(np.float32)
+        self.frames = np.concatenate([self.frames, mfcc])
+        self.score_windows()
+        ready = [midpoint for midpoint in self.candidates if self.frame_at(midpoint + self.regression_window_size / 2) <= self.total_frames]
+        emitted = self.regress(ready)
+        self.trim()
+        return emitted
+
+    def frame_at(self, time):
+        return windowing.time_to_frame(max(time, 0), self.sr, self.hop_length)
+
+    def score_windows(self):
+        first = len(self.scores)
+        available = self.total_frames // self.window_frames
+        if available <= first:
+            return
+        starts = [i * self.window_frames - self.frame_offset for i in range(first, available)]
+        segments = np.stack([self.frames[start:start + self.window_frames] for start in starts])
+        self.scores.extend(self.classification_model.predict(segments, verbose=0).flatten().tolist())
+        # A window is decided once its successor is scored
+        for i in range(max(first - 1, 0), len(self.scores) - 1):
+            if self.is_peak(i):
+                self.candidates.append(self.midpoint(i))
+
+    def midpoint(self, i):
+        return float(windowing.window_midpoints(i, self.window_frames, sr=self.sr, hop_length=self.hop_length))
+
+    def is_peak(self, i, final=False):
+        score = self.scores[i]
+        if score < self.threshold:
+            return False
+        if i > 0 and score < self.scores[i - 1]:
+            return False
+        return final or score > self.scores[i + 1]
+
+    def regress(self, midpoints, final=False):
+        if not midpoints:
+            return []
+        duration = self.total_frames * self.hop_length / self.sr if final else np.inf
+        windows = [self.adjusted_window(midpoint, duration) for midpoint in midpoints]
+        start_frames = [self.frame_at(start_time) - self.frame_offset for start_time, _ in windows]
+        end_frames = [self.frame_at(start_time + length) - self.frame_offset for start_time, length in windows]
+        batch = windowing.gather_windows(self.frames, start_frames, self.regression_frames, end_frames)
+        offsets = self.regression_model.predict(batch, verbose=0).flatten()
+        self.candidates = [midpoint for midpoint in self.candidates if midpoint not in midpoints]
+        timestamps = [float(np.clip(start_time + offset, 0, duration)) for (start_time, _), offset in zip(windows, offsets)]
+        return sorted(timestamps)
+
+    def adjusted_window(self, midpoint, duration):
+        half_window = self.regression_window_size / 2
+        start_time = max(0, midpoint - half_window)
+        end_time = min(duration, midpoint + half_window)
+        return start_time, end_time - start_time
+
+    def trim(self):
+        excess = len(self.frames) - self.history_frames
+        if excess > 0:
+            self.frames = self.frames[excess:]
+            self.frame_offset += excess
+
+def read_pcm(source, sr=22050, chunk_seconds=1.0, follow=False, idle_timeout=30.0):
+    chunk_bytes = int(chunk_seconds * sr) * 4
+    stream = sys.stdin.buffer if source == '-' else open(source, 'rb')
+    remainder = b''
+    idle_since = None
+    try:
+        while True:
+            data = stream.read(chunk_bytes)
+            if not data:
+                if not follow:
+                    break
+                # Growing file: wait for the writer until it has been idle too long
+                idle_since = idle_since or time.monotonic()
+                if time.monotonic() - idle_since > idle_timeout:
+                    break
+                time.sleep(0.5)
+                continue
+            idle_since = None
+            data = remainder + data
+            usable = len(data) - len(data) % 4
+            remainder = data[usable:]
+            yield np.frombuffer(data[:usable], dtype='<f4')
+    finally:
+        if stream is not sys.stdin.buffer:
+            stream.close()
+
+def run(detector, source, output_path, follow=False):
+    with open(output_path, 'a') as f:
+        def emit(timestamps):
+            for ts in timestamps:
+                f.write(f"{ts}\n")
+                f.flush()
+                print(f"Transition at {ts:.2f}s (stream position {detector.total_frames * detector.hop_length / detector.sr:.0f}s)", flush=True)
+        for samples in read_pcm(source, sr=detector.sr, follow=follow):
+            emit(detector.push(samples))
+        emit(detector.finish())
+    return output_path
+
+def output_name(source):
+    if source == '-':
+        return 'stream_transitions.txt'
+    return os.path.splitext(os.path.basename(source))[0] + '_transitions.txt'
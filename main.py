@@ -1,141 +1,490 @@
 import os
+import glob
+import time
 import argparse
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
 import numpy as np
-import tensorflow as tf
-import librosa
 import utils
 import model
+import feature_cache
+import feature_format
+import label_store
+import windowing
+import server
+import instrument
+import fingerprint
+import sweep
+import mp3_cut
 
 input_dir = 'input'
 model_dir = 'models'
-feature_dir = model_dir
+feature_dir = feature_cache.cache_dir
 segments_file = 'input/segments.txt'
+sr = 22050
+hop_length = 512
+window_size = 30
+# Seconds between classification window starts; below window_size the windows overlap
+window_hop = 10
+regression_window_size = 180
+# Upper bound on transitions per file; peaks also need transition_threshold and window_size spacing
+num_transitions = 8
+transition_threshold = 0.5
+export_tolerance = 1e-4
+stream_threshold = 0.5
+sweep_results = os.path.join(model_dir, 'sweep_results.txt')
 
-def train():
+def open_labels():
+    labels = label_store.connect()
+    if os.path.exists(segments_file) and label_store.import_segments_file(labels, segments_file):
+        print(f"Imported labels from {segments_file}")
+    return labels
+
+def train(workers=None):
     make_dirs()
-    segments_dict = utils.parse_segments_file(segments_file)
-    all_features = []
-    all_labels = []
-    for audio_file in os.listdir(input_dir):
-        if not audio_file.endswith('.wav'):
-            continue
-        basename = os.path.splitext(audio_file)[0]
-        audio_path = os.path.join(input_dir, audio_file)
-        feature_path = os.path.join(feature_dir, basename + '.npy')
-        if not os.path.exists(feature_path):
-            features = utils.extract_features(audio_path)
-            np.save(feature_path, features)
-        else:
-            features = np.load(feature_path)
-        split_points = segments_dict.get(basename, [])
-        labels = utils.generate_classification_labels(features, split_points)
-        all_features.append(features)
-        all_labels.append(labels)
-    if not all_features:
-        print("No wav files found in the input directory")
-        return
-    combined_features = np.concatenate(all_features, axis=0)
-    combined_labels = np.concatenate(all_labels, axis=0)
-    classification_dataset = utils.create_classification_dataset(combined_features, combined_labels)
+    with instrument.stage('labels'):
+        labels = open_labels()
+        segments_dict = label_store.load_split_points(labels)
+        labels.close()
+    window_frames = windowing.seconds_to_frames(window_size, sr, hop_length)
+    hop_frames = windowing.seconds_to_frames(window_hop, sr, hop_length)
+    audio_paths = [os.path.join(input_dir, f) for f in sorted(os.listdir(input_dir)) if f.endswith(utils.audio_extensions)]
+    with instrument.stage('features'):
+        feature_paths = feature_cache.extract_all(audio_paths, feature_dir, workers=workers, sr=sr, hop_length=hop_length)
+    train_feature_paths = []
+    window_labels = []
+    with instrument.stage('window_labels'):
+        for audio_path, feature_path in feature_paths.items():
+            basename = os.path.splitext(os.path.basename(audio_path))[0]
+            num_frames = feature_cache.read_features(feature_path, mmap_mode='r').shape[0]
+            split_points = segments_dict.get(basename, [])
+            train_feature_paths.append(feature_path)
+            window_labels.append(windowing.window_labels(num_frames, split_points, window_frames, hop_frames, sr=sr, hop_length=hop_length))
+            instrument.count('frames', num_frames)
+            instrument.count('training_windows', len(window_labels[-1]))
+    if not train_feature_paths:
+        print("No audio files found in the input directory")
+        return
+    train_dataset, validation_dataset, input_shape = utils.create_classification_dataset(train_feature_paths, window_labels, window_frames, hop_frames)
     # Build and compile classification model
-    input_shape = combined_features.shape[1:]
     classification_model = model.build_classification_model(input_shape)
     model.compile_classification_model(classification_model)
     # Train classification model
     print("Training classification model")
-    classification_model.fit(classification_dataset, epochs=1, validation_split=0.1)
+    with instrument.stage('fit_classification'):
+        classification_model.fit(train_dataset, epochs=1, validation_data=validation_dataset)
     classification_model_path = os.path.join(model_dir, 'classification_model.h5')
     model.save_model(classification_model, classification_model_path)
     print(f"Classification model saved")
     # Prepare data for regression model using classification model's predictions
-    regression_features, regression_labels = utils.prepare_regression_data(input_dir, feature_dir, segments_dict, classification_model)
-    if regression_features and regression_labels:
-        regression_features = np.array(regression_features)
-        regression_labels = np.array(regression_labels)
-        regression_dataset = utils.create_regression_dataset(regression_features, regression_labels)
+    with instrument.stage('prepare_regression_data'):
+        regression_features, regression_labels = utils.prepare_regression_data(input_dir, feature_dir, segments_dict, instrument.wrap_model(classification_model, 'classification'),
+                                                                                sr=sr, hop_length=hop_length, window_size=window_size, window_hop=window_hop,
+                                                                                regression_window_size=regression_window_size)
+    if regression_features is not None and len(regression_features):
+        regression_train_dataset, regression_validation_dataset = utils.create_regression_dataset(regression_features, regression_labels)
         # Build and compile regression model
         regression_input_shape = regression_features.shape[1:]
         regression_model = model.build_regression_model(regression_input_shape)
         model.compile_regression_model(regression_model)
         print("Training regression model")
-        regression_model.fit(regression_dataset, epochs=1, validation_split=0.1)
+        with instrument.stage('fit_regression'):
+            regression_model.fit(regression_train_dataset, epochs=1, validation_data=regression_validation_dataset)
         regression_model_path = os.path.join(model_dir, 'regression_model.h5')
         model.save_model(regression_model, regression_model_path)
         print(f"Regression model saved")
     else:
         print("No regression data available to train the regression model")
 
-def infer(input_file):
-    sr = 22050
-    hop_length = 512
-    window_size = 30
-    regression_window_size = 180
-    num_transitions = 8
+def load_models(backend='keras'):
+    if backend == 'numpy':
+        import numpy_model
+        classification_model_path = os.path.join(model_dir, 'classification_model.npz')
+        regression_model_path = os.path.join(model_dir, 'regression_model.npz')
+        if not os.path.exists(classification_model_path) or not os.path.exists(regression_model_path):
+            print("Exported models not found. Please run the export mode first.")
+            return None, None
+        return instrument.wrap_model(numpy_model.load_model(classification_model_path), 'classification'), instrument.wrap_model(numpy_model.load_model(regression_model_path), 'regression')
     classification_model_path = os.path.join(model_dir, 'classification_model.h5')
     regression_model_path = os.path.join(model_dir, 'regression_model.h5')
     if not os.path.exists(classification_model_path) or not os.path.exists(regression_model_path):
         print("Models not found. Please train the models first.")
+        return None, None
+    import tensorflow as tf
+    classification_model = tf.keras.models.load_model(classification_model_path, compile=False)
+    regression_model = tf.keras.models.load_model(regression_model_path, compile=False)
+    return instrument.wrap_model(classification_model, 'classification'), instrument.wrap_model(regression_model, 'regression')
+
+def export_models():
+    import numpy_model
+    classification_model, regression_model = load_models()
+    if classification_model is None:
+        return
+    for name, keras_model in (('classification_model', classification_model), ('regression_model', regression_model)):
+        export_path = os.path.join(model_dir, name + '.npz')
+        numpy_model.export_model(keras_model, export_path)
+        difference = numpy_model.max_difference(keras_model, numpy_model.load_model(export_path))
+        print(f"Exported {export_path} ({os.path.getsize(export_path) / 1024:.0f} KB, max output difference {difference:.2e})")
+        if difference > export_tolerance:
+            print(f"Warning: {name} NumPy outputs differ from Keras by more than {export_tolerance}")
+
+def detect_transitions(features, audio_duration, classification_model, regression_model, probabilities=None):
+    probabilities_list = None if probabilities is None else [probabilities]
+    return detect_transitions_batch([features], [audio_duration], classification_model, regression_model, probabilities_list)[0]
+
+def detect_transitions_batch(features_list, durations, classification_model, regression_model, probabilities_list=None):
+    # Segments and regression windows of all files share one predict call each
+    instrument.count('frames', sum(len(features) for features in features_list))
+    if probabilities_list is None:
+        required_frames = windowing.seconds_to_frames(window_size, sr, hop_length)
+        hop_frames = windowing.seconds_to_frames(window_hop, sr, hop_length)
+        segments_list = [windowing.frame_windows(features, required_frames, hop_frames) for features in features_list]
+        probabilities_list = [None] * len(features_list)
+        active = [i for i, segments in enumerate(segments_list) if len(segments)]
+        if active:
+            classification_probs = classification_model.predict(np.concatenate([segments_list[i] for i in active]), verbose=0).flatten()
+            offsets = np.cumsum([0] + [len(segments_list[i]) for i in active])
+            for n, i in enumerate(active):
+                probabilities_list[i] = classification_probs[offsets[n]:offsets[n + 1]]
+    results = [None] * len(features_list)
+    active = [i for i, probabilities in enumerate(probabilities_list) if probabilities is not None and len(probabilities)]
+    instrument.count('windows', sum(len(probabilities_list[i]) for i in active))
+    if not active:
+        return results
+    start_times_list = []
+    regression_windows_list = []
+    for i in active:
+        predicted_midpoints = utils.select_transition_points(probabilities_list[i], window_size=window_size, num_transitions=num_transitions, window_hop=window_hop, threshold=transition_threshold,
+                                                               sr=sr, hop_length=hop_length)
+        start_times, regression_windows = utils.get_regression_windows(features_list[i], predicted_midpoints, regression_window_size, durations[i], sr=sr, hop_length=hop_length)
+        start_times_list.append(start_times)
+        regression_windows_list.append(regression_windows)
+    regression_windows = np.concatenate(regression_windows_list)
+    instrument.count('regression_windows', len(regression_windows))
+    # No window may clear the threshold, and an empty batch is not worth a predict call
+    regression_preds = regression_model.predict(regression_windows, verbose=0).flatten() if len(regression_windows) else np.zeros(0)
+    offsets = np.cumsum([0] + [len(start_times) for start_times in start_times_list])
+    for n, i in enumerate(active):
+        results[i] = np.clip(start_times_list[n] + regression_preds[offsets[n]:offsets[n + 1]], 0, durations[i])
+    return results
+
+def write_transitions(basename, transition_timestamps):
+    output_path = basename + '_transitions.txt'
+    with open(output_path, 'w') as f:
+        for ts in transition_timestamps:
+            f.write(f"{ts}\n")
+    return output_path
+
+def read_transitions(path):
+    with open(path, 'r') as f:
+        return [float(line) for line in f if line.strip()]
+
+def cached_probabilities(audio_path, classification_model, model_hash=None):
+    window_frames = windowing.seconds_to_frames(window_size, sr, hop_length)
+    hop_frames = windowing.seconds_to_frames(window_hop, sr, hop_length)
+    return feature_cache.get_probabilities(audio_path, classification_model, window_frames, hop_frames, feature_dir,
+                                           model_hash=model_hash, sr=sr, hop_length=hop_length)
+
+def infer(input_file, backend='keras'):
+    with instrument.stage('load_models'):
+        classification_model, regression_model = load_models(backend)
+    if classification_model is None:
         return
-    classification_model = tf.keras.models.load_model(classification_model_path)
-    regression_model = tf.keras.models.load_model(regression_model_path)
     audio_path = os.path.join(input_dir, input_file)
     if not os.path.exists(audio_path):
         print(f"Audio file {audio_path} not found.")
         return
     basename = os.path.splitext(os.path.basename(audio_path))[0]
-    feature_path = os.path.join(feature_dir, basename + '.npy')
-    if not os.path.exists(feature_path):
-        features = utils.extract_features(audio_path)
-        np.save(feature_path, features)
-    else:
-        features = np.load(feature_path)
-    required_frames = int(window_size * sr / hop_length)
-    num_frames = features.shape[0]
-    num_segments = num_frames // required_frames
-    segments = features[:num_segments * required_frames].reshape(num_segments, required_frames, -1)
-    classification_probs = classification_model.predict(segments).flatten()
-    predicted_midpoints = utils.select_transition_points(classification_probs, window_size=window_size, num_transitions=num_transitions)
-    # Predict exact timestamps using regression model
-    audio_duration = librosa.get_duration(filename=audio_path)
-    transition_timestamps = []
-    for midpoint in predicted_midpoints:
-        start_time, duration = utils.get_adjusted_window(midpoint, regression_window_size, audio_duration)
-        segment_features = utils.get_segment_features(features, start_time, duration, sr=sr, hop_length=hop_length)
-        required_frames_reg = int(regression_window_size * sr / hop_length)
-        if segment_features.shape[0] < required_frames_reg:
-            # Pad if necessary
-            pad_width = required_frames_reg - segment_features.shape[0]
-            segment_features = np.pad(segment_features, ((0, pad_width), (0, 0)), mode='constant')
-        segment_features = np.expand_dims(segment_features, axis=0)
-        regression_pred = regression_model.predict(segment_features)
-        exact_timestamp = start_time + regression_pred[0][0]
-        exact_timestamp = np.clip(exact_timestamp, 0, audio_duration)
-        transition_timestamps.append(exact_timestamp)
-    output_path = basename + '_transitions.txt'
-    with open(output_path, 'w') as f:
-        for ts in transition_timestamps:
-            f.write(f"{ts}\n")
+    with instrument.stage('features'):
+        features = feature_cache.load_features(audio_path, feature_dir, mmap_mode='r', sr=sr, hop_length=hop_length)
+        audio_duration = windowing.frames_duration(len(features), sr, hop_length)
+    with instrument.stage('probabilities'):
+        probabilities = cached_probabilities(audio_path, classification_model)
+    with instrument.stage('detect'):
+        transition_timestamps = detect_transitions(features, audio_duration, classification_model, regression_model, probabilities)
+    if transition_timestamps is None:
+        print(f"Audio file {audio_path} is shorter than one {window_size} s window.")
+        return
+    write_transitions(basename, transition_timestamps)
     print(f"Detected transition timestamps saved")
 
+def list_audio_files(source):
+    if os.path.isdir(source):
+        return [os.path.join(source, f) for f in sorted(os.listdir(source)) if f.endswith(utils.audio_extensions)]
+    return [path for path in sorted(glob.glob(source)) if path.endswith(utils.audio_extensions)]
+
+def infer_batch(source, backend='keras'):
+    audio_paths = list_audio_files(source)
+    if not audio_paths:
+        print(f"No audio files found for {source}")
+        return
+    with instrument.stage('load_models'):
+        classification_model, regression_model = load_models(backend)
+    if classification_model is None:
+        return
+    model_hash = feature_cache.weights_hash(classification_model)
+    start = time.perf_counter()
+    total_audio = 0.0
+    predict_time = 0.0
+    failed = []
+    # A single extraction process prepares the next file while the current one is predicted
+    context = multiprocessing.get_context('spawn')
+    with ProcessPoolExecutor(max_workers=1, mp_context=context) as executor:
+        submit = lambda path: executor.submit(feature_cache.timed_feature_path, path, feature_dir, sr=sr, hop_length=hop_length)
+        pending = submit(audio_paths[0])
+        for i, audio_path in enumerate(audio_paths):
+            future = pending
+            if i + 1 < len(audio_paths):
+                pending = submit(audio_paths[i + 1])
+            name = os.path.basename(audio_path)
+            try:
+                with instrument.stage('wait_features'):
+                    feature_path, timings = future.result()
+                features = feature_cache.read_features(feature_path, mmap_mode='r')
+            except Exception as e:
+                print(f"[{i + 1}/{len(audio_paths)}] Failed to extract {name}: {e!r}")
+                failed.append(audio_path)
+                continue
+            audio_duration = windowing.frames_duration(len(features), sr, hop_length)
+            predict_start = time.perf_counter()
+            with instrument.stage('detect'):
+                probabilities = cached_probabilities(audio_path, classification_model, model_hash)
+                transition_timestamps = detect_transitions(features, audio_duration, classification_model, regression_model, probabilities)
+            predict_time += time.perf_counter() - predict_start
+            instrument.current.record_file(audio_path, detect=time.perf_counter() - predict_start, **timings)
+            if transition_timestamps is None:
+                print(f"[{i + 1}/{len(audio_paths)}] Skipped {name}: shorter than one {window_size} s window")
+                failed.append(audio_path)
+                continue
+            output_path = write_transitions(os.path.splitext(name)[0], transition_timestamps)
+            total_audio += audio_duration
+            print(f"[{i + 1}/{len(audio_paths)}] {name} -> {output_path}")
+    elapsed = time.perf_counter() - start
+    processed = len(audio_paths) - len(failed)
+    print(f"Processed {processed}/{len(audio_paths)} files, {total_audio / 3600:.2f} h of audio in {elapsed:.1f}s")
+    if elapsed > 0:
+        print(f"Throughput: {processed / elapsed:.2f} files/s, {total_audio / elapsed:.0f}x realtime, {predict_time:.1f}s in predict")
+
+def load_audio_for_inference(audio_path):
+    if not os.path.exists(audio_path):
+        raise FileNotFoundError(f"Audio file {audio_path} not found.")
+    features = feature_cache.load_features(audio_path, feature_dir, sr=sr, hop_length=hop_length)
+    return features, windowing.frames_duration(len(features), sr, hop_length)
+
+def serve(port, backend='keras'):
+    classification_model, regression_model = load_models(backend)
+    if classification_model is None:
+        return
+    predict_batch = lambda features_list, durations: detect_transitions_batch(features_list, durations, classification_model, regression_model)
+    server.serve(predict_batch, load_audio_for_inference, port=port, sr=sr, hop_length=hop_length, n_mfcc=feature_cache.default_params['n_mfcc'])
+
+def stream(source, backend='keras', threshold=stream_threshold, follow=False):
+    import live
+    classification_model, regression_model = load_models(backend)
+    if classification_model is None:
+        return
+    detector = live.StreamingDetector(classification_model, regression_model, sr=sr, hop_length=hop_length, window_size=window_size,
+                                      regression_window_size=regression_window_size, threshold=threshold)
+    output_path = live.output_name(source)
+    live.run(detector, source, output_path, follow=follow)
+    print(f"Stream ended, transitions appended to {output_path}")
+
+def find_audio(basename, directory=input_dir):
+    for extension in utils.audio_extensions:
+        audio_path = os.path.join(directory, basename + extension)
+        if os.path.exists(audio_path):
+            return audio_path
+    return None
+
+def build_fingerprints():
+    make_dirs()
+    labels = open_labels()
+    ranges = label_store.load_ranges(labels)
+    labels.close()
+    entries = []
+    for basename, file_ranges in ranges.items():
+        audio_path = find_audio(basename)
+        if not file_ranges or audio_path is None:
+            continue
+        features = feature_cache.load_features(audio_path, feature_dir, mmap_mode='r', sr=sr, hop_length=hop_length)
+        entries.append((basename, features, file_ranges))
+    index = fingerprint.build_index(entries, sr=sr, hop_length=hop_length)
+    fingerprint.save_index(index)
+    print(f"Indexed {len(index.spots)} labeled ranges from {len(entries)} files ({len(index.embeddings)} windows) in {fingerprint.index_path}")
+
+def match(input_file):
+    if not os.path.exists(fingerprint.index_path):
+        print("Fingerprint index not found. Please run the index mode first.")
+        return
+    audio_path = os.path.join(input_dir, input_file)
+    if not os.path.exists(audio_path):
+        print(f"Audio file {audio_path} not found.")
+        return
+    index = fingerprint.load_index()
+    features = feature_cache.load_features(audio_path, feature_dir, sr=sr, hop_length=hop_length)
+    matches = index.match(features)
+    output_path = os.path.splitext(os.path.basename(audio_path))[0] + '_matches.txt'
+    with open(output_path, 'w') as f:
+        for m in matches:
+            f.write(f"{m['start']:.2f} {m['end']:.2f} {m['source']} {m['source_start']:.2f} {m['similarity']:.3f}\n")
+    print(f"{len(matches)} known segments found, saved to {output_path}")
+
+def run_sweep(grid_path=None, workers=None):
+    make_dirs()
+    try:
+        grid = sweep.load_grid(grid_path)
+    except (OSError, ValueError) as e:
+        print(f"Error: could not read sweep grid {grid_path}: {e}")
+        return
+    defaults = {'window_size': window_size, 'window_hop': window_hop, 'regression_window_size': regression_window_size, 'hop_length': hop_length,
+                'num_transitions': num_transitions, 'threshold': transition_threshold, 'filters': 64, 'kernel_size': 3, 'units': 64,
+                'regression_filters': 64, 'regression_units': 64, 'epochs': 1, 'seed': 0}
+    trials = sweep.expand_grid(grid, defaults)
+    labels = open_labels()
+    split_points = label_store.load_split_points(labels)
+    labels.close()
+    audio_paths = [os.path.join(input_dir, f) for f in sorted(os.listdir(input_dir)) if f.endswith(utils.audio_extensions)]
+    basenames = [os.path.splitext(os.path.basename(path))[0] for path in audio_paths]
+    train_names, validation_names = sweep.split_files(basenames, split_points)
+    if not validation_names or not train_names:
+        print("A sweep needs at least two audio files, one of them labeled, to hold out for scoring")
+        return
+    print(f"Training on {len(train_names)} files, scoring on {len(validation_names)} labeled files")
+    # Features are extracted once per hop length; the trials only read the cache
+    feature_paths = {}
+    for trial_hop_length in sorted({trial['hop_length'] for trial in trials}):
+        paths = feature_cache.extract_all(audio_paths, feature_dir, workers=workers, sr=sr, hop_length=trial_hop_length)
+        feature_paths[str(trial_hop_length)] = {os.path.splitext(os.path.basename(path))[0]: os.path.abspath(feature_path) for path, feature_path in paths.items()}
+    data = {'sr': sr, 'feature_paths': feature_paths, 'split_points': split_points, 'train': train_names, 'validation': validation_names}
+    with instrument.stage('sweep'):
+        results = sweep.run_sweep(trials, data, workers=workers)
+    instrument.count('trials', len(results))
+    print(sweep.format_table(results[:10], grid))
+    table_path, json_path = sweep.write_results(results, grid, sweep_results)
+    print(f"Sweep results saved to {table_path} and {json_path}")
+
+def ad_ranges(basename, ranges_path=None, leading_ad=False):
+    # An explicit segments or transitions file first, then labeled ranges, then this file's detected transitions
+    if ranges_path:
+        with open(ranges_path, 'r') as f:
+            is_segments_file = any(line.strip().startswith('[') for line in f)
+        if is_segments_file:
+            return utils.parse_segments_ranges(ranges_path).get(basename), ranges_path
+        return mp3_cut.transitions_to_ranges(read_transitions(ranges_path), leading_ad), ranges_path
+    labels = open_labels()
+    ranges = label_store.get_ranges(labels, basename)
+    labels.close()
+    if ranges:
+        return ranges, label_store.store_path
+    transitions_path = basename + '_transitions.txt'
+    if os.path.exists(transitions_path):
+        return mp3_cut.transitions_to_ranges(read_transitions(transitions_path), leading_ad), transitions_path
+    return None, None
+
+def cut(input_file, ranges_path=None, leading_ad=False):
+    audio_path = os.path.join(input_dir, input_file)
+    if not os.path.exists(audio_path):
+        print(f"Audio file {audio_path} not found.")
+        return
+    if not audio_path.endswith('.mp3'):
+        print("Error: Only mp3 files can be cut without re-encoding.")
+        return
+    basename = os.path.splitext(os.path.basename(audio_path))[0]
+    try:
+        ranges, source = ad_ranges(basename, ranges_path, leading_ad)
+    except (OSError, ValueError) as e:
+        print(f"Error: could not read ad ranges from {ranges_path}: {e}")
+        return
+    if ranges is None:
+        print(f"No ad ranges for {basename}. Label it, run infer on it or pass --ranges.")
+        return
+    output_path = basename + '_clean.mp3'
+    start = time.perf_counter()
+    try:
+        stats = mp3_cut.cut(audio_path, output_path, ranges)
+    except ValueError as e:
+        print(f"Error: {e}")
+        return
+    print(f"Removed {len(ranges)} ranges from {source}, {stats['removed_seconds']:.1f}s of {stats['seconds']:.1f}s, "
+          f"saved to {output_path} in {time.perf_counter() - start:.1f}s")
+
 def make_dirs():
     os.makedirs(model_dir, exist_ok=True)
     os.makedirs(feature_dir, exist_ok=True)
 
+def hop_seconds(value):
+    seconds = float(value)
+    # Anything under one frame would make the window hop zero frames
+    if not seconds >= hop_length / sr:
+        raise argparse.ArgumentTypeError(f"must be at least one frame ({hop_length / sr:.3f} s), got {value}")
+    return seconds
+
 def parse_arguments():
     parser = argparse.ArgumentParser(description="Audio Content Style Change Detection")
-    parser.add_argument('mode', type=str, choices=['train', 'infer'], help='Choose mode: training or inference')
-    parser.add_argument('file', nargs='?', type=str, help='File name (without extension) for inference mode')
+    parser.add_argument('mode', type=str, choices=['train', 'infer', 'infer-batch', 'serve', 'export', 'stream', 'index', 'match', 'sweep', 'cut'], help='Choose mode: training, inference, batch inference, inference server, model export, live stream detection, fingerprint indexing of labeled ranges, matching a file against them, a hyperparameter sweep or cutting ads out of an mp3')
+    parser.add_argument('file', nargs='?', type=str, help='File name for infer, match and cut modes, a directory or glob for infer-batch, raw mono float32 PCM at 22050 Hz (- for stdin) for stream, or a JSON grid of parameter lists for sweep')
+    parser.add_argument('--backend', choices=['keras', 'numpy'], default='keras', help='Inference runtime; numpy runs exported weights without TensorFlow')
+    parser.add_argument('--threshold', type=float, default=None, help=f'Minimum classification score for a transition (default: {transition_threshold})')
+    parser.add_argument('--hop', type=hop_seconds, default=None, help=f'Seconds between classification window starts (default: {window_hop})')
+    parser.add_argument('--ranges', default=None, help='Segments file (such as a_segments.txt) or transitions file with the ad ranges for cut mode (default: labeled ranges, then <name>_transitions.txt)')
+    parser.add_argument('--leading-ad', action='store_true', help='In cut mode, treat the audio before the first transition as an ad')
+    parser.add_argument('--follow', action='store_true', help='Keep reading a growing PCM file in stream mode')
+    parser.add_argument('--port', type=int, default=8765, help='Port for serve mode')
+    parser.add_argument('--workers', type=int, default=None, help='Number of feature extraction or sweep trial processes (default: CPU count for extraction, a quarter of it for sweep trials, each of which loads its own TensorFlow)')
+    parser.add_argument('--feature-format', choices=feature_format.storage_formats, default=None, help='Storage format for newly cached features in the feature directory (kept for later runs)')
+    parser.add_argument('--report', default=None, help='Write a JSON report of stage timings, cache hits and predict calls to this file')
+    parser.add_argument('--profile', default=None, help='Write cProfile stats for the whole run to this file')
     return parser.parse_args()
 
 def main():
+    global window_hop, transition_threshold, stream_threshold
     args = parse_arguments()
+    if args.hop is not None:
+        window_hop = args.hop
+    if args.threshold is not None:
+        transition_threshold = stream_threshold = args.threshold
+    if args.feature_format:
+        feature_cache.set_storage_format(args.feature_format, feature_dir)
+    if args.report:
+        instrument.start(args.mode)
+    with instrument.profiled(args.profile):
+        run(args)
+    if args.report:
+        print(f"Run report written to {instrument.stop().write(args.report)}")
+
+def run(args):
     if args.mode == 'train':
-        train()
+        train(workers=args.workers)
     elif args.mode == 'infer':
         if not args.file:
             print("Error: No file name provided for infer mode.")
             return
-        infer(args.file)
+        infer(args.file, args.backend)
+    elif args.mode == 'infer-batch':
+        if not args.file:
+            print("Error: No directory or glob provided for infer-batch mode.")
+            return
+        infer_batch(args.file, args.backend)
+    elif args.mode == 'stream':
+        stream(args.file or '-', args.backend, stream_threshold, args.follow)
+    elif args.mode == 'export':
+        export_models()
+    elif args.mode == 'serve':
+        serve(args.port, args.backend)
+    elif args.mode == 'index':
+        build_fingerprints()
+    elif args.mode == 'match':
+        if not args.file:
+            print("Error: No file name provided for match mode.")
+            return
+        match(args.file)
+    elif args.mode == 'sweep':
+        run_sweep(args.file, workers=args.workers)
+    elif args.mode == 'cut':
+        if not args.file:
+            print("Error: No file name provided for cut mode.")
+            return
+        cut(args.file, args.ranges, args.leading_ad)
 
 if __name__ == "__main__":
     main()
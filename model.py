@@ -1,22 +1,21 @@
-import tensorflow as tf
-from tensorflow.keras import layers, models
-
-def build_classification_model(input_shape):
+def build_classification_model(input_shape, filters=64, kernel_size=3, units=64):
+    from tensorflow.keras import layers, models
     inputs = layers.Input(shape=input_shape)
-    x = layers.Conv1D(64, kernel_size=3, activation='relu')(inputs)
+    x = layers.Conv1D(filters, kernel_size=kernel_size, activation='relu')(inputs)
     x = layers.MaxPooling1D(pool_size=2)(x)
     x = layers.Flatten()(x)
-    x = layers.Dense(64, activation='relu')(x)
+    x = layers.Dense(units, activation='relu')(x)
     outputs = layers.Dense(1, activation='sigmoid')(x)
     model = models.Model(inputs=inputs, outputs=outputs)
     return model
 
-def build_regression_model(input_shape):
+def build_regression_model(input_shape, filters=64, kernel_size=3, units=64):
+    from tensorflow.keras import layers, models
     inputs = layers.Input(shape=input_shape)
-    x = layers.Conv1D(64, kernel_size=3, activation='relu')(inputs)
+    x = layers.Conv1D(filters, kernel_size=kernel_size, activation='relu')(inputs)
     x = layers.MaxPooling1D(pool_size=2)(x)
     x = layers.Flatten()(x)
-    x = layers.Dense(64, activation='relu')(x)
+    x = layers.Dense(units, activation='relu')(x)
     outputs = layers.Dense(1, activation='linear')(x)
     model = models.Model(inputs=inputs, outputs=outputs)
     return model
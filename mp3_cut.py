@@ -0,0 +1,231 @@
+import os
+import array
+
+# Indexed by [MPEG-1][layer] and [MPEG-2/2.5][layer], in kbit/s
+bitrates = {
+    (True, 1): (0, 32, 64, 96, 128, 160, 192, 224, 256, 288, 320, 352, 384, 416, 448),
+    (True, 2): (0, 32, 48, 56, 64, 80, 96, 112, 128, 160, 192, 224, 256, 320, 384),
+    (True, 3): (0, 32, 40, 48, 56, 64, 80, 96, 112, 128, 160, 192, 224, 256, 320),
+    (False, 1): (0, 32, 48, 56, 64, 80, 96, 112, 128, 144, 160, 176, 192, 224, 256),
+    (False, 2): (0, 8, 16, 24, 32, 40, 48, 56, 64, 80, 96, 112, 128, 144, 160),
+    (False, 3): (0, 8, 16, 24, 32, 40, 48, 56, 64, 80, 96, 112, 128, 144, 160),
+}
+# Version bits 0, 2, 3 are MPEG-2.5, MPEG-2 and MPEG-1
+sample_rates = {0: (11025, 12000, 8000), 2: (22050, 24000, 16000), 3: (44100, 48000, 32000)}
+read_block = 1 << 20
+# Larger than any legal frame, so a buffer holding this much always holds a whole frame
+max_frame_bytes = 4096
+trailing_tags = (b'TAG', b'APE', b'LYR', b'ID3')
+
+def parse_header(data, pos):
+    # (frame bytes, samples, sample rate, stream key) for a valid MPEG audio header, else None
+    if data[pos] != 0xFF or data[pos + 1] & 0xE0 != 0xE0:
+        return None
+    version = (data[pos + 1] >> 3) & 3
+    layer = 4 - ((data[pos + 1] >> 1) & 3)
+    bitrate_index = data[pos + 2] >> 4
+    rate_index = (data[pos + 2] >> 2) & 3
+    if version == 1 or layer == 4 or bitrate_index in (0, 15) or rate_index == 3:
+        return None
+    mpeg1 = version == 3
+    bitrate = bitrates[(mpeg1, layer)][bitrate_index] * 1000
+    sample_rate = sample_rates[version][rate_index]
+    padding = (data[pos + 2] >> 1) & 1
+    if layer == 1:
+        return (12 * bitrate // sample_rate + padding) * 4, 384, sample_rate, (version, layer, sample_rate)
+    samples = 1152 if mpeg1 or layer == 2 else 576
+    return samples // 8 * bitrate // sample_rate + padding, samples, sample_rate, (version, layer, sample_rate)
+
+def info_tag_offset(data, pos):
+    # Offset of a Xing/Info tag inside the frame at pos, which holds the frame count, byte count and seek table of the stream
+    mpeg1 = (data[pos + 1] >> 3) & 3 == 3
+    mono = data[pos + 3] >> 6 == 3
+    offset = 4 + ((17 if mono else 32) if mpeg1 else (9 if mono else 17))
+    return offset if bytes(data[pos + offset:pos + offset + 4]) in (b'Xing', b'Info') else None
+
+def is_vbri_frame(data, pos):
+    return bytes(data[pos + 36:pos + 40]) == b'VBRI'
+
+def crc16(data):
+    # CRC-16/ARC, as used by the LAME tag
+    crc = 0
+    for byte in data:
+        crc ^= byte
+        for _ in range(8):
+            crc = (crc >> 1) ^ 0xA001 if crc & 1 else crc >> 1
+    return crc
+
+def rewrite_info_frame(frame, tag, removed_frames, total_bytes, toc, trim_start, trim_end):
+    # The info frame is kept so players still see the right duration and can seek, with its counts and table redone for the cut stream
+    frame = bytearray(frame)
+    flags = int.from_bytes(frame[tag + 4:tag + 8], 'big')
+    field = tag + 8
+    if flags & 1:
+        frame[field:field + 4] = max(int.from_bytes(frame[field:field + 4], 'big') - removed_frames, 0).to_bytes(4, 'big')
+        field += 4
+    if flags & 2:
+        frame[field:field + 4] = total_bytes.to_bytes(4, 'big')
+        field += 4
+    if flags & 4:
+        frame[field:field + 100] = bytes(toc)
+        field += 100
+    if flags & 8:
+        field += 4
+    if bytes(frame[field:field + 4]) == b'LAME' and len(frame) >= field + 36:
+        # Encoder delay and padding only describe the original first and last frames
+        delay = 0 if trim_start else int.from_bytes(frame[field + 21:field + 24], 'big') >> 12
+        padding = 0 if trim_end else int.from_bytes(frame[field + 21:field + 24], 'big') & 0xFFF
+        frame[field + 21:field + 24] = ((delay << 12) | padding).to_bytes(3, 'big')
+        frame[field + 28:field + 32] = total_bytes.to_bytes(4, 'big')
+        frame[field + 34:field + 36] = crc16(frame[:field + 34]).to_bytes(2, 'big')
+    return bytes(frame)
+
+def seek_table(frame_offsets, total_bytes):
+    # Byte position at every percent of the duration, scaled to 0-255, from the start of each kept frame
+    if not frame_offsets:
+        return bytes(100)
+    return bytes(min(frame_offsets[min(i * len(frame_offsets) // 100, len(frame_offsets) - 1)] * 256 // max(total_bytes, 1), 255) for i in range(100))
+
+def id3v2_size(f):
+    f.seek(0)
+    header = f.read(10)
+    if len(header) < 10 or header[:3] != b'ID3':
+        return 0
+    size = 0
+    for byte in header[6:10]:
+        size = (size << 7) | (byte & 0x7F)
+    # A footer flag adds a second 10-byte block at the end of the tag
+    return size + 10 + (10 if header[5] & 0x10 else 0)
+
+def id3v1_size(f, file_size):
+    if file_size < 128:
+        return 0
+    f.seek(file_size - 128)
+    return 128 if f.read(3) == b'TAG' else 0
+
+def iter_frames(f, start, end):
+    # (offset, bytes, samples, sample rate, block, position in block) of every frame between start and end, reading one block at a time
+    f.seek(start)
+    buffer = b''
+    base = start
+    pos = 0
+    remaining = end - start
+    stream = None
+    while True:
+        if len(buffer) - pos < max_frame_bytes and remaining > 0:
+            block = f.read(min(read_block, remaining))
+            remaining -= len(block)
+            buffer = buffer[pos:] + block
+            base += pos
+            pos = 0
+        if len(buffer) - pos < 4:
+            return
+        header = parse_header(buffer, pos)
+        if header is not None and stream is not None and header[3] != stream:
+            header = None
+        if header is not None:
+            # A sync word only counts if another frame or a tag follows right behind it, so garbage is skipped instead of copied;
+            # an info frame carries its own proof in the Xing/Info tag
+            following = pos + header[0]
+            if (following + 4 <= len(buffer) and buffer[following:following + 3] not in trailing_tags
+                    and (parse_header(buffer, following) or (None,) * 4)[3] != header[3] and info_tag_offset(buffer, pos) is None):
+                header = None
+        if header is None or pos + header[0] > len(buffer):
+            if header is not None:
+                # Truncated last frame
+                return
+            next_sync = buffer.find(b'\xff', pos + 1)
+            pos = len(buffer) if next_sync < 0 else next_sync
+            continue
+        length, samples, sample_rate, stream = header
+        yield base + pos, length, samples, sample_rate, buffer, pos
+        pos += length
+
+def copy_range(source, destination, start, end):
+    source.seek(start)
+    while start < end:
+        block = source.read(min(read_block, end - start))
+        if not block:
+            break
+        destination.write(block)
+        start += len(block)
+
+def cut(input_path, output_path, ranges):
+    # Copies every frame that starts outside the ranges (seconds), keeping the ID3 tags, without decoding anything
+    ranges = sorted(ranges)
+    file_size = os.path.getsize(input_path)
+    kept = []
+    info = None
+    # Output position of each kept frame, relative to the info frame, for its seek table; 4 bytes per frame
+    frame_offsets = array.array('I')
+    written = 0
+    stats = {'frames': 0, 'kept_frames': 0, 'seconds': 0.0, 'removed_seconds': 0.0}
+    with open(input_path, 'rb') as f:
+        tag_end = id3v2_size(f)
+        trailer = id3v1_size(f, file_size)
+        samples_before = 0
+        first = True
+        first_audio_kept = None
+        last_kept = False
+        r = 0
+        for offset, length, samples, sample_rate, buffer, pos in iter_frames(f, tag_end, file_size - trailer):
+            if first:
+                first = False
+                tag = info_tag_offset(buffer, pos)
+                if tag is not None:
+                    info = (bytes(buffer[pos:pos + length]), tag)
+                    written = length
+                    continue
+                if is_vbri_frame(buffer, pos):
+                    # Rarely used and not worth rewriting; players fall back to scanning without it
+                    continue
+            time = samples_before / sample_rate
+            samples_before += samples
+            stats['frames'] += 1
+            while r < len(ranges) and time >= ranges[r][1]:
+                r += 1
+            last_kept = not (r < len(ranges) and time >= ranges[r][0])
+            if first_audio_kept is None:
+                first_audio_kept = last_kept
+            if not last_kept:
+                stats['removed_seconds'] += samples / sample_rate
+                continue
+            stats['kept_frames'] += 1
+            frame_offsets.append(written)
+            written += length
+            # Neighbouring frames are merged into one byte range so the copy is a few large reads
+            if kept and kept[-1][1] == offset:
+                kept[-1][1] = offset + length
+            else:
+                kept.append([offset, offset + length])
+        stats['seconds'] = samples_before / sample_rate if stats['frames'] else 0.0
+    if stats['frames'] == 0:
+        raise ValueError(f"no MPEG audio frames found in {input_path}")
+    temp_path = output_path + '.tmp'
+    try:
+        with open(input_path, 'rb') as source, open(temp_path, 'wb') as destination:
+            copy_range(source, destination, 0, tag_end)
+            if info is not None:
+                destination.write(rewrite_info_frame(info[0], info[1], stats['frames'] - stats['kept_frames'], written,
+                                                     seek_table(frame_offsets, written), not first_audio_kept, not last_kept))
+            for start, end in kept:
+                copy_range(source, destination, start, end)
+            copy_range(source, destination, file_size - trailer, file_size)
+            destination.flush()
+            os.fsync(destination.fileno())
+        os.replace(temp_path, output_path)
+    except BaseException:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        raise
+    stats['bytes'] = os.path.getsize(output_path)
+    return stats
+
+def transitions_to_ranges(transitions, leading_ad=False):
+    # Detected transitions alternate between content and ads; which side comes first is not known from them alone
+    points = sorted(transitions)
+    if leading_ad:
+        points = [0.0] + points
+    if len(points) % 2:
+        points.append(float('inf'))
+    return [(points[i], points[i + 1]) for i in range(0, len(points), 2)]
@@ -0,0 +1,97 @@
+import json
+import numpy as np
+
+format_version = 2
+predict_batch_size = 32
+
+activations = {
+    'relu': lambda x: np.maximum(x, 0, out=x),
+    'sigmoid': lambda x: 0.5 * (1 + np.tanh(0.5 * x)),
+    'linear': lambda x: x,
+}
+
+def conv1d(x, kernel, bias, strides=1):
+    kernel_size, channels, filters = kernel.shape
+    # im2col through a strided view, then one matrix product for all positions
+    patches = np.lib.stride_tricks.sliding_window_view(x, kernel_size, axis=1)[:, ::strides]
+    patches = patches.transpose(0, 1, 3, 2).reshape(x.shape[0], -1, kernel_size * channels)
+    return patches @ kernel.reshape(kernel_size * channels, filters) + bias
+
+def max_pool1d(x, pool_size=2, strides=2):
+    if pool_size == strides:
+        length = x.shape[1] // pool_size
+        return x[:, :length * pool_size].reshape(x.shape[0], length, pool_size, -1).max(axis=2)
+    return np.lib.stride_tricks.sliding_window_view(x, pool_size, axis=1)[:, ::strides].max(axis=-1)
+
+class NumpyModel:
+    def __init__(self, layers, weights):
+        self.layers = layers
+        self.weights = weights
+
+    def forward(self, x):
+        for i, layer in enumerate(self.layers):
+            if layer['type'] == 'conv1d':
+                x = activations[layer['activation']](conv1d(x, self.weights[f'{i}_kernel'], self.weights[f'{i}_bias'], layer['strides']))
+            elif layer['type'] == 'maxpool1d':
+                x = max_pool1d(x, layer['pool_size'], layer['strides'])
+            elif layer['type'] == 'flatten':
+                x = x.reshape(x.shape[0], -1)
+            elif layer['type'] == 'dense':
+                x = activations[layer['activation']](x @ self.weights[f'{i}_kernel'] + self.weights[f'{i}_bias'])
+        return x
+
+    def predict(self, x, verbose=0, batch_size=None):
+        x = np.asarray(x, dtype=np.float32)
+        batch_size = batch_size or predict_batch_size
+        if len(x) <= batch_size:
+            return self.forward(x)
+        # Chunked so the im2col patches stay bounded for long regression windows
+        return np.concatenate([self.forward(x[i:i + batch_size]) for i in range(0, len(x), batch_size)])
+
+def load_model(path):
+    with np.load(path) as archive:
+        header = json.loads(str(archive['header']))
+        if header.get('version') != format_version:
+            raise ValueError(f"{path} was exported with an unsupported format, please export it again")
+        weights = {name: archive[name] for name in archive.files if name != 'header'}
+    return NumpyModel(header['layers'], weights)
+
+def describe_layer(layer):
+    config = layer.get_config()
+    kind = type(layer).__name__
+    if kind == 'InputLayer':
+        return None
+    if kind == 'Conv1D':
+        if config['padding'] != 'valid' or config['dilation_rate'] not in (1, (1,), [1]):
+            raise ValueError(f"Conv1D layer {layer.name} uses unsupported padding or dilation")
+        return {'type': 'conv1d', 'strides': int(np.ravel(config['strides'])[0]), 'activation': config['activation']}
+    if kind == 'MaxPooling1D':
+        if config['padding'] != 'valid':
+            raise ValueError(f"MaxPooling1D layer {layer.name} uses unsupported padding")
+        return {'type': 'maxpool1d', 'pool_size': int(np.ravel(config['pool_size'])[0]), 'strides': int(np.ravel(config['strides'])[0])}
+    if kind == 'Flatten':
+        return {'type': 'flatten'}
+    if kind == 'Dense':
+        return {'type': 'dense', 'activation': config['activation']}
+    raise ValueError(f"Layer {layer.name} of type {kind} cannot be exported")
+
+def export_model(keras_model, path):
+    layers = []
+    arrays = {}
+    for layer in keras_model.layers:
+        description = describe_layer(layer)
+        if description is None:
+            continue
+        if description.get('activation', 'linear') not in activations:
+            raise ValueError(f"Layer {layer.name} uses unsupported activation {description['activation']}")
+        if description['type'] in ('conv1d', 'dense'):
+            kernel, bias = layer.get_weights()
+            arrays[f'{len(layers)}_kernel'] = kernel.astype(np.float32)
+            arrays[f'{len(layers)}_bias'] = bias.astype(np.float32)
+        layers.append(description)
+    header = json.dumps({'version': format_version, 'input_shape': list(keras_model.input_shape[1:]), 'layers': layers})
+    np.savez_compressed(path, header=np.array(header), **arrays)
+
+def max_difference(keras_model, numpy_model, num_samples=8, seed=0):
+    x = np.random.default_rng(seed).standard_normal((num_samples,) + tuple(keras_model.input_shape[1:])).astype(np.float32)
+    return float(np.abs(keras_model.predict(x, verbose=0) - numpy_model.predict(x)).max())
@@ -0,0 +1,135 @@
+import json
+import time
+import queue
+import threading
+from concurrent.futures import Future
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+import numpy as np
+import windowing
+
+host = '127.0.0.1'
+max_batch_jobs = 16
+batch_wait = 0.02
+
+class MicroBatcher:
+    def __init__(self, predict_batch, max_jobs=max_batch_jobs, wait=batch_wait):
+        self.predict_batch = predict_batch
+        self.max_jobs = max_jobs
+        self.wait = wait
+        self.jobs = queue.Queue()
+        self.batches = 0
+        self.jobs_done = 0
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    def submit(self, features, duration):
+        future = Future()
+        self.jobs.put((features, duration, future))
+        return future
+
+    def run(self):
+        # Only this thread touches the models, requests wait on their futures
+        while True:
+            batch = [self.jobs.get()]
+            deadline = time.monotonic() + self.wait
+            while len(batch) < self.max_jobs:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    batch.append(self.jobs.get(timeout=remaining))
+                except queue.Empty:
+                    break
+            try:
+                results = self.predict_batch([job[0] for job in batch], [job[1] for job in batch])
+            except Exception as e:
+                if len(batch) == 1:
+                    batch[0][2].set_exception(e)
+                    continue
+                # One bad job must not fail the others it was batched with, so the batch is retried job by job
+                for job in batch:
+                    self.run_alone(job)
+                continue
+            self.batches += 1
+            self.jobs_done += len(batch)
+            for job, result in zip(batch, results):
+                job[2].set_result(result)
+
+    def run_alone(self, job):
+        try:
+            result = self.predict_batch([job[0]], [job[1]])[0]
+        except Exception as e:
+            job[2].set_exception(e)
+            return
+        self.batches += 1
+        self.jobs_done += 1
+        job[2].set_result(result)
+
+def make_handler(batcher, load_audio, sr, hop_length, n_mfcc):
+    class InferenceHandler(BaseHTTPRequestHandler):
+        def send_json(self, status, payload):
+            body = json.dumps(payload).encode('utf-8')
+            self.send_response(status)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def load(self, path):
+            try:
+                return load_audio(path)
+            except (OSError, ValueError):
+                raise
+            except Exception as e:
+                # Decoders raise their own types (soundfile RuntimeError, audioread NoBackendError) for files that are not audio
+                raise ValueError(f"could not decode {path}: {e!r}")
+
+        def do_GET(self):
+            if self.path != '/health':
+                self.send_json(404, {'error': 'not found'})
+                return
+            self.send_json(200, {'status': 'ok', 'batches': batcher.batches, 'requests': batcher.jobs_done})
+
+        def do_POST(self):
+            if self.path != '/infer':
+                self.send_json(404, {'error': 'not found'})
+                return
+            try:
+                length = int(self.headers.get('Content-Length', 0))
+                request = json.loads(self.rfile.read(length))
+                if 'features' in request:
+                    features = np.asarray(request['features'], dtype=np.float32)
+                    if features.ndim != 2:
+                        raise ValueError("features must be a 2D frames x coefficients array")
+                    if features.shape[1] != n_mfcc:
+                        raise ValueError(f"features must have {n_mfcc} coefficients per frame, got {features.shape[1]}")
+                    duration = float(request.get('duration', windowing.frames_duration(features.shape[0], sr, hop_length)))
+                elif 'path' in request:
+                    features, duration = self.load(request['path'])
+                else:
+                    raise ValueError("request needs either 'path' or 'features'")
+            except (OSError, ValueError) as e:
+                self.send_json(400, {'error': str(e)})
+                return
+            try:
+                transitions = batcher.submit(features, duration).result()
+            except Exception as e:
+                self.send_json(500, {'error': repr(e)})
+                return
+            if transitions is None:
+                self.send_json(422, {'error': 'audio is shorter than one classification window'})
+                return
+            self.send_json(200, {'transitions': [float(ts) for ts in transitions]})
+
+    return InferenceHandler
+
+def serve(predict_batch, load_audio, port=8765, sr=22050, hop_length=512, n_mfcc=13):
+    batcher = MicroBatcher(predict_batch)
+    httpd = ThreadingHTTPServer((host, port), make_handler(batcher, load_audio, sr, hop_length, n_mfcc))
+    print(f"Serving transition detection on http://{host}:{port}/infer")
+    try:
+        httpd.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        httpd.server_close()
@@ -0,0 +1,128 @@
+import time
+import tempfile
+import numpy as np
+import scipy.fft
+import soundfile as sf
+import soxr
+import librosa
+
+class MelStream:
+    def __init__(self, sr=22050, hop_length=512, n_fft=2048, n_mels=128):
+        self.sr = sr
+        self.hop_length = hop_length
+        self.n_fft = n_fft
+        self.n_mels = n_mels
+        # Leading zeros reproduce librosa's centered, constant-padded first frame
+        self.buffer = np.zeros(n_fft // 2, dtype=np.float32)
+
+    def push(self, y):
+        self.buffer = np.concatenate([self.buffer, np.asarray(y, dtype=np.float32)])
+        if len(self.buffer) < self.n_fft:
+            return np.zeros((0, self.n_mels), dtype=np.float32)
+        num_frames = 1 + (len(self.buffer) - self.n_fft) // self.hop_length
+        span = (num_frames - 1) * self.hop_length + self.n_fft
+        S = librosa.feature.melspectrogram(y=self.buffer[:span], sr=self.sr, n_fft=self.n_fft,
+                                           hop_length=self.hop_length, n_mels=self.n_mels, center=False)
+        # Keep the samples the next frame still needs
+        self.buffer = self.buffer[num_frames * self.hop_length:]
+        return librosa.power_to_db(S, top_db=None).T
+
+    def flush(self):
+        return self.push(np.zeros(self.n_fft // 2, dtype=np.float32))
+
+def mel_to_mfcc(mel_db, n_mfcc=13, floor_db=None):
+    if floor_db is not None:
+        mel_db = np.maximum(mel_db, floor_db)
+    return scipy.fft.dct(mel_db, axis=1, type=2, norm='ortho')[:, :n_mfcc]
+
+def read_blocks(audio_path, sr=22050, block_seconds=60):
+    try:
+        source = read_soundfile_blocks(audio_path, block_seconds)
+        native_sr = next(source)
+    except sf.SoundFileRuntimeError:
+        source = read_audioread_blocks(audio_path, block_seconds)
+        native_sr = next(source)
+    if native_sr == sr:
+        yield from source
+        return
+    resampler = soxr.ResampleStream(native_sr, sr, 1, dtype='float32', quality='HQ')
+    total_in = 0
+    emitted = 0
+    for y in source:
+        total_in += len(y)
+        y = resampler.resample_chunk(y)
+        emitted += len(y)
+        yield y
+    # Match librosa.resample's output length of ceil(n * ratio)
+    expected = int(np.ceil(total_in * float(sr) / native_sr))
+    tail = resampler.resample_chunk(np.zeros(0, dtype=np.float32), last=True)
+    tail = librosa.util.fix_length(tail, size=max(0, expected - emitted))
+    if len(tail):
+        yield tail
+
+def read_soundfile_blocks(audio_path, block_seconds):
+    with sf.SoundFile(audio_path) as f:
+        yield f.samplerate
+        blocksize = int(block_seconds * f.samplerate)
+        for block in f.blocks(blocksize=blocksize, dtype='float32', always_2d=True):
+            yield block.mean(axis=1)
+
+def read_audioread_blocks(audio_path, block_seconds):
+    import audioread
+    with audioread.audio_open(audio_path) as f:
+        yield f.samplerate
+        target = int(block_seconds * f.samplerate)
+        pending = []
+        pending_len = 0
+        for buf in f:
+            y = librosa.util.buf_to_float(buf, n_bytes=2, dtype=np.float32)
+            if f.channels > 1:
+                y = y.reshape((-1, f.channels)).mean(axis=1)
+            pending.append(y)
+            pending_len += len(y)
+            if pending_len >= target:
+                yield np.concatenate(pending)
+                pending = []
+                pending_len = 0
+        if pending:
+            yield np.concatenate(pending)
+
+def extract_features_streaming(audio_path, sr=22050, n_mfcc=13, hop_length=512, block_seconds=60, top_db=80.0, timings=None):
+    stream = MelStream(sr=sr, hop_length=hop_length)
+    peak = -np.inf
+    num_frames = 0
+    start = time.perf_counter()
+    decode = 0.0
+    # Log-mel frames are spilled to disk so the global top_db floor can be applied in a second pass
+    with tempfile.TemporaryFile() as spill:
+        blocks = read_blocks(audio_path, sr=sr, block_seconds=block_seconds)
+        while True:
+            decode_start = time.perf_counter()
+            y = next(blocks, None)
+            decode += time.perf_counter() - decode_start
+            if y is None:
+                break
+            mel_db = stream.push(y)
+            if len(mel_db):
+                peak = max(peak, float(mel_db.max()))
+                spill.write(mel_db.astype(np.float32).tobytes())
+                num_frames += len(mel_db)
+        mel_db = stream.flush()
+        if len(mel_db):
+            peak = max(peak, float(mel_db.max()))
+            spill.write(mel_db.astype(np.float32).tobytes())
+            num_frames += len(mel_db)
+        spill.flush()
+        mfcc = np.empty((num_frames, n_mfcc), dtype=np.float32)
+        if num_frames == 0:
+            return mfcc
+        mel_frames = np.memmap(spill, dtype=np.float32, mode='r', shape=(num_frames, stream.n_mels))
+        floor_db = peak - top_db if top_db is not None else None
+        step = max(1, int(block_seconds * sr / hop_length))
+        for first in range(0, num_frames, step):
+            mfcc[first:first + step] = mel_to_mfcc(mel_frames[first:first + step], n_mfcc=n_mfcc, floor_db=floor_db)
+        del mel_frames
+    if timings is not None:
+        timings['decode'] = decode
+        timings['features'] = time.perf_counter() - start - decode
+    return mfcc
@@ -0,0 +1,207 @@
+import os
+import json
+import time
+import itertools
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, as_completed
+import numpy as np
+import utils
+import model
+import feature_cache
+import windowing
+
+# Grid used when no JSON grid file is given; keys not listed keep the defaults passed in
+default_grid = {
+    'window_size': [20, 30, 45],
+    'filters': [32, 64],
+    'epochs': [1, 3],
+}
+trial_keys = ('window_size', 'window_hop', 'regression_window_size', 'hop_length', 'num_transitions', 'threshold',
+              'filters', 'kernel_size', 'units', 'regression_filters', 'regression_units', 'epochs', 'seed')
+# A predicted transition this far from every labeled one counts as spurious, and a labeled one as missed
+tolerance = 15.0
+validation_every = 5
+predict_batch = 1024
+# Each trial process holds its own TensorFlow runtime and models, roughly 1-2 GB, so by default only a quarter of the cores run trials
+default_workers = max((os.cpu_count() or 1) // 4, 1)
+
+def load_grid(path=None):
+    if not path:
+        return dict(default_grid)
+    with open(path, 'r') as f:
+        grid = json.load(f)
+    unknown = sorted(set(grid) - set(trial_keys))
+    if unknown:
+        raise ValueError(f"unknown sweep parameters: {', '.join(unknown)}")
+    return {key: values if isinstance(values, list) else [values] for key, values in grid.items()}
+
+def expand_grid(grid, defaults):
+    keys = sorted(grid)
+    return [dict(defaults, **dict(zip(keys, values))) for values in itertools.product(*(grid[key] for key in keys))]
+
+def split_files(basenames, split_points):
+    # Every validation_every-th labeled file is held out; unlabeled files only ever train, as negatives
+    labeled = sorted(name for name in basenames if name in split_points)
+    validation = set(labeled[validation_every // 2::validation_every] or labeled[-1:])
+    return [name for name in basenames if name not in validation], sorted(validation)
+
+def match_transitions(predicted, true_points):
+    # Closest pairs first, one-to-one, within tolerance
+    pairs = sorted((abs(p - t), i, j) for i, p in enumerate(predicted) for j, t in enumerate(true_points) if abs(p - t) <= tolerance)
+    used_predicted, used_true, errors = set(), set(), []
+    for distance, i, j in pairs:
+        if i in used_predicted or j in used_true:
+            continue
+        used_predicted.add(i)
+        used_true.add(j)
+        errors.append(distance)
+    return {'matched': len(errors), 'predicted': len(predicted), 'labeled': len(true_points), 'error_sum': float(sum(errors))}
+
+def timestamp_score(counts):
+    # Seconds of error per labeled transition, charging tolerance for every miss and every spurious prediction
+    matched = counts['matched']
+    missed = counts['labeled'] - matched
+    spurious = counts['predicted'] - matched
+    precision = matched / counts['predicted'] if counts['predicted'] else 0.0
+    recall = matched / counts['labeled'] if counts['labeled'] else 0.0
+    return {
+        'score': (counts['error_sum'] + tolerance * (missed + spurious)) / max(counts['labeled'], 1),
+        'mean_error': counts['error_sum'] / matched if matched else None,
+        'precision': precision,
+        'recall': recall,
+        'f1': 2 * precision * recall / (precision + recall) if precision + recall else 0.0,
+    }
+
+def classify(classification_model, features_list, window_frames, hop_frames):
+    # Bounded batches of strided views, so a trial never copies more than predict_batch windows out of the shared cache
+    probabilities_list = []
+    for features in features_list:
+        windows = windowing.frame_windows(features, window_frames, hop_frames)
+        probabilities = [classification_model.predict(np.asarray(windows[i:i + predict_batch], dtype=np.float32), verbose=0).flatten()
+                         for i in range(0, len(windows), predict_batch)]
+        probabilities_list.append(np.concatenate(probabilities) if probabilities else np.zeros(0, dtype=np.float32))
+    return probabilities_list
+
+def regression_windows(features, probabilities, trial, sr, threshold=None):
+    midpoints = utils.select_transition_points(probabilities, window_size=trial['window_size'], num_transitions=trial['num_transitions'],
+                                               window_hop=trial['window_hop'], threshold=threshold, sr=sr, hop_length=trial['hop_length'])
+    duration = windowing.frames_duration(len(features), sr, trial['hop_length'])
+    start_times, windows = utils.get_regression_windows(features, midpoints, trial['regression_window_size'], duration, sr=sr, hop_length=trial['hop_length'])
+    return midpoints, start_times, windows, duration
+
+def run_trial(trial, data):
+    import tensorflow as tf
+    tf.keras.utils.set_random_seed(trial['seed'])
+    start = time.perf_counter()
+    sr = data['sr']
+    hop_length = trial['hop_length']
+    window_frames = windowing.seconds_to_frames(trial['window_size'], sr, hop_length)
+    hop_frames = windowing.seconds_to_frames(trial['window_hop'], sr, hop_length)
+    # Every trial memory-maps the same cache files, so the page cache holds one copy for all workers
+    paths = data['feature_paths'][str(hop_length)]
+    features = {name: feature_cache.read_features(path, mmap_mode='r') for name, path in paths.items()}
+    train_names = [name for name in data['train'] if name in features]
+    validation_names = [name for name in data['validation'] if name in features]
+    labels = [windowing.window_labels(len(features[name]), data['split_points'].get(name, []), window_frames, hop_frames, sr=sr, hop_length=hop_length)
+              for name in train_names]
+    train_dataset, _, input_shape = utils.create_classification_dataset([paths[name] for name in train_names], labels, window_frames, hop_frames, validation_split=0)
+    classification_model = model.build_classification_model(input_shape, filters=trial['filters'], kernel_size=trial['kernel_size'], units=trial['units'])
+    model.compile_classification_model(classification_model)
+    classification_model.fit(train_dataset, epochs=trial['epochs'], verbose=0)
+    # Regression examples come from the trained classifier's peaks on the training files, as in train mode
+    labeled = [name for name in train_names if data['split_points'].get(name)]
+    regression_features, regression_labels = [], []
+    for name, probabilities in zip(labeled, classify(classification_model, [features[name] for name in labeled], window_frames, hop_frames)):
+        if len(probabilities) == 0:
+            continue
+        midpoints, start_times, windows, _ = regression_windows(features[name], probabilities, trial, sr)
+        regression_features.append(windows)
+        regression_labels.extend(utils.find_closest_split_point(midpoint, data['split_points'][name]) - start_time
+                                 for midpoint, start_time in zip(midpoints, start_times))
+    regression_model = None
+    if regression_labels:
+        regression_features = np.concatenate(regression_features)
+        regression_model = model.build_regression_model(regression_features.shape[1:], filters=trial['regression_filters'],
+                                                        kernel_size=trial['kernel_size'], units=trial['regression_units'])
+        model.compile_regression_model(regression_model)
+        regression_dataset, _ = utils.create_regression_dataset(regression_features, np.array(regression_labels, dtype=np.float32), validation_split=0)
+        regression_model.fit(regression_dataset, epochs=trial['epochs'], verbose=0)
+    trained = time.perf_counter()
+    counts = {'matched': 0, 'predicted': 0, 'labeled': 0, 'error_sum': 0.0}
+    for name, probabilities in zip(validation_names, classify(classification_model, [features[name] for name in validation_names], window_frames, hop_frames)):
+        predicted = []
+        if len(probabilities):
+            _, start_times, windows, duration = regression_windows(features[name], probabilities, trial, sr, threshold=trial['threshold'])
+            offsets = regression_model.predict(windows, verbose=0).flatten() if regression_model is not None and len(windows) else np.zeros(len(windows))
+            predicted = np.clip(start_times + offsets, 0, duration).tolist()
+        for key, value in match_transitions(predicted, data['split_points'][name]).items():
+            counts[key] += value
+    result = dict(trial, **timestamp_score(counts), **counts)
+    result['parameters'] = classification_model.count_params() + (regression_model.count_params() if regression_model is not None else 0)
+    result['train_seconds'] = trained - start
+    result['evaluate_seconds'] = time.perf_counter() - trained
+    return result
+
+def init_worker(threads):
+    import tensorflow as tf
+    # Trials share the machine, so each one gets its slice of the cores instead of all of them
+    tf.config.threading.set_intra_op_parallelism_threads(threads)
+    tf.config.threading.set_inter_op_parallelism_threads(2)
+
+def run_sweep(trials, data, workers=None):
+    workers = max(min(workers or default_workers, len(trials)), 1)
+    threads = max((os.cpu_count() or 1) // workers, 1)
+    print(f"Running {len(trials)} trials with {workers} workers, {threads} threads each")
+    results = []
+    varied = [key for key in trial_keys if len({repr(trial[key]) for trial in trials}) > 1]
+    context = multiprocessing.get_context('spawn')
+    with ProcessPoolExecutor(max_workers=workers, mp_context=context, initializer=init_worker, initargs=(threads,)) as executor:
+        futures = {executor.submit(run_trial, trial, data): trial for trial in trials}
+        for done, future in enumerate(as_completed(futures), 1):
+            trial = futures[future]
+            try:
+                result = future.result()
+            except Exception as e:
+                print(f"[{done}/{len(trials)}] Trial {describe(trial, varied)} failed: {e!r}")
+                results.append(dict(trial, error=repr(e)))
+                continue
+            print(f"[{done}/{len(trials)}] {describe(trial, varied)}: score {result['score']:.2f}s, f1 {result['f1']:.2f} "
+                  f"in {result['train_seconds'] + result['evaluate_seconds']:.0f}s")
+            results.append(result)
+    return rank(results)
+
+def describe(trial, keys):
+    return ' '.join(f"{key}={trial[key]}" for key in keys) or 'defaults'
+
+def rank(results):
+    # Lower score first; failed trials last
+    return sorted(results, key=lambda r: (r.get('score') is None, r.get('score') or 0.0, -(r.get('f1') or 0.0)))
+
+def format_table(results, grid):
+    varied = [key for key in trial_keys if key in grid]
+    columns = ['rank', 'score', 'f1', 'precision', 'recall', 'mean_error'] + varied + ['parameters', 'seconds']
+    rows = []
+    for n, result in enumerate(results, 1):
+        row = {'rank': n, 'seconds': result.get('train_seconds', 0) + result.get('evaluate_seconds', 0)}
+        row.update((key, result.get(key)) for key in columns if key not in row)
+        rows.append(['failed' if key == 'score' and 'error' in result else format_value(row[key]) for key in columns])
+    widths = [max(len(column), *(len(row[i]) for row in rows)) if rows else len(column) for i, column in enumerate(columns)]
+    lines = ['  '.join(column.rjust(width) for column, width in zip(columns, widths))]
+    lines.extend('  '.join(value.rjust(width) for value, width in zip(row, widths)) for row in rows)
+    return '\n'.join(lines)
+
+def format_value(value):
+    if value is None:
+        return '-'
+    if isinstance(value, float):
+        return f"{value:.3f}"
+    return str(value)
+
+def write_results(results, grid, path):
+    with open(path, 'w') as f:
+        f.write(f"# Transition timestamp error in seconds per labeled transition, tolerance {tolerance}s; lower is better\n")
+        f.write(format_table(results, grid) + '\n')
+    json_path = os.path.splitext(path)[0] + '.json'
+    with open(json_path, 'w') as f:
+        json.dump({'grid': grid, 'tolerance': tolerance, 'results': results}, f, indent=1)
+    return path, json_path
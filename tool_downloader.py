@@ -1,10 +1,22 @@
 import os
+import json
+import argparse
+import tempfile
+import hashlib
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+from concurrent.futures import ThreadPoolExecutor, as_completed
 import xml.etree.ElementTree as ET
 from datetime import datetime
 
 download_folder = os.path.join(os.getcwd(), 'input')
 rss_feed_url_source = os.path.join(download_folder, 'config.txt')
+feed_state_path = os.path.join(download_folder, 'feed_state.json')
+feed_url_key = 'url'
+download_workers = 4
+chunk_size = 1 << 16
+request_timeout = (10, 60)
 
 def read_feed_url(file_path, key):
     try:
@@ -24,45 +36,224 @@ def format_filename(pub_date_str):
     dt = datetime.strptime(pub_date_str, '%a, %d %b %Y %H:%M:%S %z')
     return dt.strftime('%d %b %H') + '.mp3'
 
+def unique_filenames(episodes):
+    # Names only carry day and hour, so items from different years can share one; parallel downloads
+    # would then append to the same .part file, so later ones get a short hash of their GUID
+    used = set()
+    unique = []
+    for media_url, filename, guid in episodes:
+        if filename in used:
+            stem, extension = os.path.splitext(filename)
+            filename = f'{stem} {hashlib.sha1(guid.encode("utf-8")).hexdigest()[:8]}{extension}'
+        used.add(filename)
+        unique.append((media_url, filename, guid))
+    return unique
+
 def is_downloaded(filename):
     return os.path.isfile(os.path.join(download_folder, filename))
 
-def download_file(url, filename):
-    response = requests.get(url, stream=True)
-    response.raise_for_status()
+def create_session(pool_size=download_workers):
+    retry = Retry(total=5, backoff_factor=1, status_forcelist=[429, 500, 502, 503, 504], allowed_methods=['GET', 'HEAD'])
+    adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size, max_retries=retry)
+    session = requests.Session()
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+    return session
+
+def get_validator(response):
+    # If-Range only accepts a strong ETag or a Last-Modified date
+    etag = response.headers.get('ETag')
+    if etag and not etag.startswith('W/'):
+        return etag
+    return response.headers.get('Last-Modified')
+
+def download_file(url, filename, session=None):
+    session = session or create_session(1)
     filepath = os.path.join(download_folder, filename)
-    with open(filepath, 'wb') as f:
-        for chunk in response.iter_content(chunk_size=8192):
-            f.write(chunk)
-    print(f'Downloaded: {filename}')
-
-def parse_feed(url):
-    response = requests.get(url)
-    response.raise_for_status()
-    content = response.content.decode('utf-8', errors='replace')
-    context = ET.iterparse(iter([content]), events=('end',))
-    for event, elem in context:
-        if elem.tag.endswith('item'):
+    part_path = filepath + '.part'
+    validator_path = part_path + '.validator'
+    offset = os.path.getsize(part_path) if os.path.exists(part_path) else 0
+    headers = {}
+    if offset and os.path.exists(validator_path):
+        with open(validator_path, 'r') as f:
+            headers['Range'] = f'bytes={offset}-'
+            headers['If-Range'] = f.read().strip()
+    else:
+        offset = 0
+    with session.get(url, stream=True, headers=headers, timeout=request_timeout) as response:
+        if response.status_code == 416:
+            # The part file already holds the whole body if its size matches the reported total
+            total = response.headers.get('Content-Range', '').rpartition('/')[2]
+            if not total.isdigit() or int(total) != offset:
+                os.remove(part_path)
+                return download_file(url, filename, session)
+            expected = offset
+        else:
+            response.raise_for_status()
+            if response.status_code != 206:
+                offset = 0
+            validator = get_validator(response)
+            if offset == 0:
+                if validator:
+                    with open(validator_path, 'w') as f:
+                        f.write(validator)
+                elif os.path.exists(validator_path):
+                    os.remove(validator_path)
+            length = response.headers.get('Content-Length')
+            expected = offset + int(length) if length and 'Content-Encoding' not in response.headers else None
+            with open(part_path, 'ab' if offset else 'wb') as f:
+                for chunk in response.iter_content(chunk_size=chunk_size):
+                    f.write(chunk)
+    size = os.path.getsize(part_path)
+    if expected is not None and size != expected:
+        raise IOError(f'{filename} is incomplete ({size} of {expected} bytes), run again to resume')
+    os.replace(part_path, filepath)
+    if os.path.exists(validator_path):
+        os.remove(validator_path)
+    print(f'Downloaded: {filename}' + (f' (resumed at {offset} bytes)' if offset else ''))
+    return filepath
+
+def load_feed_state(path=feed_state_path):
+    try:
+        with open(path, 'r') as f:
+            return json.load(f)
+    except (FileNotFoundError, json.JSONDecodeError):
+        return {}
+
+def save_feed_state(state, path=feed_state_path):
+    directory = os.path.dirname(path) or '.'
+    fd, tmp_path = tempfile.mkstemp(dir=directory, prefix='.feed_state-', suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'w') as f:
+            json.dump(state, f, indent=1)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+def parse_feed(url, session=None, backfill=False, feed_state=None):
+    session = session or create_session(1)
+    feed_state = feed_state if feed_state is not None else {}
+    seen = set(feed_state.get('seen', []))
+    headers = {}
+    # A first backfill has to see the whole feed even if a latest-only poll already stored validators
+    conditional = feed_state.get('backfilled') or not backfill
+    if conditional and feed_state.get('etag'):
+        headers['If-None-Match'] = feed_state['etag']
+    if conditional and feed_state.get('last_modified'):
+        headers['If-Modified-Since'] = feed_state['last_modified']
+    episodes = []
+    with session.get(url, headers=headers, stream=True, timeout=request_timeout) as response:
+        if response.status_code == 304:
+            print('Feed not modified since last sync')
+            return episodes, feed_state
+        response.raise_for_status()
+        new_state = {
+            'etag': response.headers.get('ETag'),
+            'last_modified': response.headers.get('Last-Modified'),
+            'seen': feed_state.get('seen', []),
+            'backfilled': bool(feed_state.get('backfilled') or backfill),
+        }
+        # Parse straight from the socket and drop each item once read
+        response.raw.decode_content = True
+        channel = None
+        for event, elem in ET.iterparse(response.raw, events=('start', 'end')):
+            if event == 'start':
+                if elem.tag == 'channel':
+                    channel = elem
+                continue
+            if not elem.tag.endswith('item'):
+                continue
             pub_date = elem.find('./pubDate')
+            guid = elem.findtext('./guid')
             media_content = None
             for media in elem.findall('./{http://search.yahoo.com/mrss/}content'):
                 if media.get('type') == 'audio/mpeg':
                     media_content = media.get('url')
                     break
-            if pub_date is not None and media_content:
-                pub_date_str = pub_date.text
-                filename = format_filename(pub_date_str)
-                if not is_downloaded(filename):
-                    download_file(media_content, filename)
-                else:
-                    print(f'Already downloaded: {filename}')
-            break
+            guid = guid or media_content
+            if pub_date is not None and media_content and guid not in seen:
+                episodes.append((media_content, format_filename(pub_date.text), guid))
+            elem.clear()
+            if channel is not None:
+                channel.remove(elem)
+            if not backfill:
+                break
+    return episodes, new_state
+
+def fetch_episode(media_url, filename, session, on_complete=None):
+    filepath = download_file(media_url, filename, session)
+    if on_complete:
+        on_complete(filepath)
+    return filepath
+
+def download_episodes(episodes, session, workers=download_workers, on_complete=None):
+    pending = []
+    done = []
+    for media_url, filename, guid in unique_filenames(episodes):
+        if is_downloaded(filename):
+            print(f'Already downloaded: {filename}')
+            done.append(guid)
+            if on_complete:
+                on_complete(os.path.join(download_folder, filename))
+        else:
+            pending.append((media_url, filename, guid))
+    failed = []
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        futures = {executor.submit(fetch_episode, media_url, filename, session, on_complete): (filename, guid) for media_url, filename, guid in pending}
+        for future in as_completed(futures):
+            filename, guid = futures[future]
+            try:
+                future.result()
+                done.append(guid)
+            except (requests.RequestException, IOError) as e:
+                print(f'Failed: {filename}: {e}')
+                failed.append(filename)
+    return done, failed
+
+def sync_feed(feed_url, session, backfill=False, workers=download_workers, on_complete=None):
+    state = load_feed_state()
+    episodes, feed_state = parse_feed(feed_url, session, backfill=backfill, feed_state=state.get(feed_url, {}))
+    if not episodes:
+        if feed_url not in state or feed_state is not state[feed_url]:
+            state[feed_url] = feed_state
+            save_feed_state(state)
+        return []
+    done, failed = download_episodes(episodes, session, workers, on_complete)
+    feed_state['seen'] = list(dict.fromkeys(feed_state['seen'] + done))
+    if failed:
+        # Without validators the next poll fetches the feed again and retries the failures
+        feed_state['etag'] = None
+        feed_state['last_modified'] = None
+    state[feed_url] = feed_state
+    save_feed_state(state)
+    return failed
 
 def main():
-    feed_url = read_feed_url(rss_feed_url_source)
+    parser = argparse.ArgumentParser(description='Download podcast episodes from the configured feed')
+    parser.add_argument('--backfill', action='store_true', help='Download every episode in the feed, not only the latest')
+    parser.add_argument('--workers', type=int, default=download_workers, help='Concurrent downloads')
+    parser.add_argument('--ingest', action='store_true', help='Extract and cache features for each episode as soon as it is downloaded')
+    parser.add_argument('--extract-workers', type=int, default=None, help='Feature extraction processes for --ingest (default: CPU count)')
+    parser.add_argument('--queue-size', type=int, default=4, help='Downloaded episodes allowed to wait for extraction')
+    args = parser.parse_args()
+    feed_url = read_feed_url(rss_feed_url_source, feed_url_key)
     if feed_url:
-        parse_feed(feed_url)
+        session = create_session(args.workers)
+        if not args.ingest:
+            sync_feed(feed_url, session, backfill=args.backfill, workers=args.workers)
+            return
+        import feature_cache
+        # Finished downloads wait in a bounded queue, so extraction backlog throttles the downloads
+        extraction = feature_cache.ExtractionQueue(workers=args.extract_workers, max_pending=args.queue_size)
+        try:
+            sync_feed(feed_url, session, backfill=args.backfill, workers=args.workers, on_complete=extraction.put)
+        finally:
+            feature_paths = extraction.close()
+        print(f'Features cached for {len(feature_paths)} episodes, {len(extraction.failed)} failed')
 
 if __name__ == '__main__':
     main()
-
@@ -0,0 +1,33 @@
+import os
+import json
+import argparse
+import urllib.request
+import urllib.error
+
+def request_transitions(audio_path, host='127.0.0.1', port=8765):
+    body = json.dumps({'path': os.path.abspath(audio_path)}).encode('utf-8')
+    request = urllib.request.Request(f'http://{host}:{port}/infer', data=body, headers={'Content-Type': 'application/json'})
+    with urllib.request.urlopen(request) as response:
+        return json.load(response)['transitions']
+
+def main():
+    parser = argparse.ArgumentParser(description="Query a running transition detection server")
+    parser.add_argument('files', nargs='+', help='Audio files to analyze')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8765)
+    args = parser.parse_args()
+    for audio_path in args.files:
+        try:
+            transitions = request_transitions(audio_path, args.host, args.port)
+        except urllib.error.HTTPError as e:
+            print(f'Error: {audio_path}: {json.load(e).get("error")}')
+            continue
+        except urllib.error.URLError as e:
+            print(f'Error: Server not reachable: {e.reason}')
+            return
+        print(f'[{os.path.basename(audio_path)}]')
+        for ts in transitions:
+            print(ts)
+
+if __name__ == '__main__':
+    main()
@@ -1,14 +1,120 @@
 import os
+import re
+import argparse
+import sqlite3
 import threading
+import subprocess
 import tkinter as tk
 from tkinter import messagebox
 from pydub import AudioSegment
 from io import BytesIO
+import numpy as np
 import pygame
+import label_store
+
+class SegmentDecoder:
+    def __init__(self, audio_file, cache_size=4):
+        self.audio_file = audio_file
+        self.duration = self.probe_duration()
+        self.cache_size = cache_size
+        self.cache = {}
+        self.loading = {}
+        self.lock = threading.Lock()
+
+    def probe_duration(self):
+        # ffmpeg prints the container duration while opening the input, nothing is decoded
+        command = [AudioSegment.converter, '-hide_banner', '-i', self.audio_file]
+        result = subprocess.run(command, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+        match = re.search(r'Duration: (\d+):(\d+):(\d+(?:\.\d+)?)', result.stderr.decode('utf-8', errors='replace'))
+        if not match:
+            raise ValueError(f"Could not read the duration of {self.audio_file}")
+        hours, minutes, seconds = match.groups()
+        return int(hours) * 3600 + int(minutes) * 60 + float(seconds)
+
+    def decode(self, start, end):
+        # ffmpeg seeks before opening the input, so only the requested window is decoded
+        command = [AudioSegment.converter, '-v', 'error', '-ss', str(start), '-t', str(end - start),
+                   '-i', self.audio_file, '-f', 'wav', '-']
+        result = subprocess.run(command, stdout=subprocess.PIPE, stderr=subprocess.PIPE, check=True)
+        return self.fix_wav_sizes(bytearray(result.stdout))
+
+    def fix_wav_sizes(self, data):
+        # A piped WAV has placeholder chunk sizes since ffmpeg cannot seek back to fill them in
+        if data[:4] != b'RIFF':
+            return bytes(data)
+        data[4:8] = (len(data) - 8).to_bytes(4, 'little')
+        offset = 12
+        while offset + 8 <= len(data):
+            chunk_size = int.from_bytes(data[offset + 4:offset + 8], 'little')
+            if data[offset:offset + 4] == b'data':
+                data[offset + 4:offset + 8] = (len(data) - offset - 8).to_bytes(4, 'little')
+                break
+            offset += 8 + chunk_size + (chunk_size & 1)
+        return bytes(data)
+
+    def load(self, key):
+        # Failures are cached as the result too, so a waiting get() always wakes up and raises them
+        data = None
+        try:
+            data = self.decode(*key)
+        except Exception as e:
+            data = e
+        finally:
+            with self.lock:
+                self.cache[key] = data
+                while len(self.cache) > self.cache_size:
+                    self.cache.pop(next(iter(self.cache)))
+                event = self.loading.pop(key)
+            event.set()
+
+    def prefetch(self, start, end):
+        key = (start, end)
+        with self.lock:
+            if key in self.cache or key in self.loading:
+                return
+            self.loading[key] = threading.Event()
+        threading.Thread(target=self.load, args=(key,), daemon=True).start()
+
+    def get(self, start, end):
+        key = (start, end)
+        self.prefetch(start, end)
+        with self.lock:
+            event = self.loading.get(key)
+        if event:
+            event.wait()
+        with self.lock:
+            data = self.cache.get(key)
+        if data is None:
+            data = self.decode(start, end)
+        if isinstance(data, Exception):
+            raise data
+        return BytesIO(data)
+
+def score_windows(audio_file, backend='keras'):
+    import main as detector
+    import feature_cache
+    import windowing
+    classification_model, _ = detector.load_models(backend)
+    if classification_model is None:
+        return None
+    features = feature_cache.load_features(audio_file, detector.feature_dir, sr=detector.sr, hop_length=detector.hop_length)
+    window_frames = windowing.seconds_to_frames(detector.window_size, detector.sr, detector.hop_length)
+    hop_frames = windowing.seconds_to_frames(detector.window_hop, detector.sr, detector.hop_length)
+    segments = windowing.frame_windows(features, window_frames, hop_frames)
+    if len(segments) == 0:
+        return None
+    # Window length and hop in the seconds the whole-frame windows really cover
+    frame_seconds = detector.hop_length / detector.sr
+    return classification_model.predict(segments, verbose=0).flatten(), window_frames * frame_seconds, hop_frames * frame_seconds
 
 class LabelLogic:
-    def __init__(self, master, audio_file, segment_duration=60):
+    def __init__(self, master, audio_file, segment_duration=60, window_scores=None, confidence=0.2, store_path=label_store.store_path, relabel=False):
         self.master = master
+        self.store_path = store_path
+        self.relabel = relabel
+        self.window_scores = window_scores
+        self.confidence = confidence
+        self.auto_accepted = []
         self.master.title("Label File")
         self.audio_file = audio_file
         self.segment_duration = segment_duration
@@ -30,8 +136,8 @@ class LabelLogic:
 
     def load_audio(self):
         try:
-            self.audio = AudioSegment.from_mp3(self.audio_file)
-            self.total_duration = len(self.audio) // 1000
+            self.decoder = SegmentDecoder(self.audio_file)
+            self.total_duration = int(self.decoder.duration)
         except Exception as e:
             messagebox.showerror("Error", f"Failed to load audio file: {e}")
             self.master.destroy()
@@ -62,6 +168,40 @@ class LabelLogic:
         remaining = self.total_duration % self.segment_duration
         if remaining > 0:
             self.queue.append({'start': num_segments * self.segment_duration, 'end': self.total_duration})
+        self.segments = list(self.queue)
+        if self.window_scores is not None:
+            self.score_segments()
+            # Segments most likely to contain a transition are asked first
+            self.queue.sort(key=lambda seg: seg['score'], reverse=True)
+
+    def score_segments(self):
+        scores, window_size, window_hop = self.window_scores
+        window_starts = np.arange(len(scores)) * window_hop
+        for i, seg in enumerate(self.segments):
+            seg['index'] = i
+            inside = (window_starts + window_size > seg['start']) & (window_starts < seg['end'])
+            # Windows not covered by the model (the tail of the file) count as uncertain
+            seg['score'] = float(scores[inside].max()) if inside.any() and window_starts[inside][-1] + window_size >= seg['end'] else 1.0
+
+    def propagate(self, segment, label):
+        # Labels only spread through segments the model is confident hold no transition,
+        # so a run of confident segments costs a single human answer
+        stack = [segment]
+        while stack:
+            seg = stack.pop()
+            if seg['score'] >= self.confidence:
+                continue
+            for neighbour_index in (seg['index'] - 1, seg['index'] + 1):
+                if not 0 <= neighbour_index < len(self.segments):
+                    continue
+                neighbour = self.segments[neighbour_index]
+                if neighbour not in self.queue or neighbour['score'] >= self.confidence:
+                    continue
+                self.queue.remove(neighbour)
+                accepted = {'start': neighbour['start'], 'end': neighbour['end'], 'label': label, 'auto': True, 'score': neighbour['score']}
+                self.classifications.append(accepted)
+                self.auto_accepted.append(accepted)
+                stack.append(neighbour)
 
     def process_next_segment(self):
         if not self.queue:
@@ -69,21 +209,21 @@ class LabelLogic:
             return
         self.current_segment = self.queue.pop(0)
         total_formatted = self.format_time(self.total_duration)
-        self.status_label.config(
-            text=f"Playing segment {self.format_time(self.current_segment['start'])} of {total_formatted}"
-        )
-        segment = self.audio[self.current_segment['start'] * 1000 : self.current_segment['end'] * 1000]
+        status = f"Playing segment {self.format_time(self.current_segment['start'])} of {total_formatted}"
+        if self.window_scores is not None:
+            status += f" ({len(self.auto_accepted)} auto-accepted, {len(self.queue)} left)"
+        self.status_label.config(text=status)
         if self.play_thread and self.play_thread.is_alive():
             self.current_sound.stop()
             self.play_thread.join()
-        self.play_thread = threading.Thread(target=self.play_audio, args=(segment,))
+        self.play_thread = threading.Thread(target=self.play_audio, args=(self.current_segment['start'], self.current_segment['end']))
         self.play_thread.start()
+        if self.queue:
+            self.decoder.prefetch(self.queue[0]['start'], self.queue[0]['end'])
 
-    def play_audio(self, segment):
+    def play_audio(self, start, end):
         try:
-            wav_io = BytesIO()
-            segment.export(wav_io, format="wav")
-            wav_io.seek(0)
+            wav_io = self.decoder.get(start, end)
             self.current_sound = pygame.mixer.Sound(file=wav_io)
             self.current_sound.play()
             while pygame.mixer.get_busy():
@@ -104,6 +244,8 @@ class LabelLogic:
             'end': self.current_segment['end'],
             'label': classification
         })
+        if self.window_scores is not None:
+            self.propagate(self.current_segment, classification)
         self.process_next_segment()
 
     def toggle_pause(self):
@@ -121,6 +263,9 @@ class LabelLogic:
                 self.current_sound.unpause()
 
     def finish_classification(self):
+        self.classifications.sort(key=lambda x: x['start'])
+        if self.auto_accepted:
+            self.save_auto_accepted()
         if not self.classifications:
             self.save_a_segments([])
             messagebox.showinfo("Done", "No segments classified")
@@ -172,14 +317,14 @@ class LabelLogic:
         for i in range(1, len(classifications)):
             if classifications[i]['label'] != classifications[i-1]['label']:
                 transitions.append((i-1, classifications[i-1]['end']))
-        for idx, trans_point in transitions:
+        for n, (idx, trans_point) in enumerate(transitions):
+            if n + 1 < len(transitions):
+                next_point = transitions[n + 1][1]
+                self.decoder.prefetch(max(next_point - 60, 0), next_point)
             window = tk.Toplevel(self.master)
             window.title("Refine Transition")
             start_time = max(trans_point - 60, 0)
-            segment = self.audio[start_time * 1000 : trans_point * 1000]
-            wav_io = BytesIO()
-            segment.export(wav_io, format="wav")
-            wav_io.seek(0)
+            wav_io = self.decoder.get(start_time, trans_point)
             pygame.mixer.music.load(wav_io)
             pygame.mixer.music.play()
             selected_time = tk.DoubleVar()
@@ -229,6 +374,7 @@ class LabelLogic:
 
     def save_a_segments(self, classifications):
         a_segments = [seg for seg in classifications if seg['label'] == "A"]
+        self.store_session(a_segments)
         if not a_segments:
             messagebox.showinfo("Done", "No ads detected. Classification complete.")
             return
@@ -257,12 +403,39 @@ class LabelLogic:
                     f.write(f"{segment}\n")
         except Exception as e:
             messagebox.showerror("Error", f"Failed to write A segments: {e}")
+    def store_session(self, a_segments):
+        # The store keeps exact times; a labeled file without ads is recorded too
+        try:
+            connection = label_store.connect(self.store_path)
+            label_store.add_session(connection, os.path.splitext(self.audio_file)[0], [(seg['start'], seg['end']) for seg in a_segments],
+                                    source=os.path.abspath(self.audio_file), replace=self.relabel)
+            connection.close()
+        except sqlite3.Error as e:
+            messagebox.showerror("Error", f"Failed to store labels: {e}")
+
+    def save_auto_accepted(self):
+        filename_without_ext = os.path.splitext(self.audio_file)[0]
+        try:
+            with open(f"{filename_without_ext}_auto_accepted.txt", "w") as f:
+                f.write(f"[{filename_without_ext}]\n")
+                for seg in sorted(self.auto_accepted, key=lambda x: x['start']):
+                    f.write(f"{self.format_time(seg['start'])}-{self.format_time(seg['end'])} {seg['label']} {seg['score']:.3f}\n")
+        except Exception as e:
+            messagebox.showerror("Error", f"Failed to write auto-accepted segments: {e}")
+
     def format_time(self, seconds):
         minutes = int(seconds) // 60
         secs = int(seconds) % 60
         return f"{minutes}:{secs:02d}"
 
 def main():
+    parser = argparse.ArgumentParser(description="Label ad segments in an audio file")
+    parser.add_argument('--assist', action='store_true', help='Pre-score segments with the classification model and auto-accept confident ones')
+    parser.add_argument('--confidence', type=float, default=0.2, help='Transition score below which a segment inherits its neighbour\'s label')
+    parser.add_argument('--backend', choices=['keras', 'numpy'], default='keras', help='Model runtime for --assist')
+    parser.add_argument('--store', default=label_store.store_path, help='Label store the session is added to')
+    parser.add_argument('--relabel', action='store_true', help='Replace earlier sessions for this file instead of merging with them')
+    args = parser.parse_args()
     basename = input("Audio file name: ")
     audio_file = f"{basename}.mp3"
     if not os.path.exists(audio_file):
@@ -270,8 +443,13 @@ def main():
         if not os.path.exists(audio_file):
             print(f"Error: Audio file not found. Enter wav or mp3 basename.")
             return
+    window_scores = None
+    if args.assist:
+        window_scores = score_windows(audio_file, args.backend)
+        if window_scores is None:
+            print("Error: Could not score segments, labeling without assistance.")
     root = tk.Tk()
-    app = LabelLogic(root, audio_file)
+    app = LabelLogic(root, audio_file, window_scores=window_scores, confidence=args.confidence, store_path=args.store, relabel=args.relabel)
     root.mainloop()
 
 if __name__ == "__main__":
@@ -1,99 +1,170 @@
 import os
+import time
 import numpy as np
-import librosa
-import tensorflow as tf
 import re
+import feature_cache
+import windowing
 
-def parse_segments_file(segments_file_path):
+audio_extensions = ('.wav', '.mp3')
+
+def parse_segments_ranges(segments_file_path):
+    # A [name] header followed by any number of start-end lines; blank and malformed lines are skipped
     segments_dict = {}
+    filename = None
     with open(segments_file_path, 'r') as f:
-        lines = f.readlines()
-        for i in range(0, len(lines), 6):
-            header = lines[i].strip()
-            filename_match = re.match(r'\[(.*?)\]', header)
+        for line_number, line in enumerate(f, 1):
+            line = line.strip()
+            if not line or line.startswith('#'):
+                continue
+            filename_match = re.fullmatch(r'\[(.*?)\]', line)
             if filename_match:
-                filename = filename_match.group(1)
-                split_points = []
-                for j in range(1, 6):
-                    time_range = lines[i+j].strip()
-                    start, end = time_range.split('-')
-                    start_sec = convert_time_to_seconds(start)
-                    end_sec = convert_time_to_seconds(end)
-                    midpoint = (start_sec + end_sec) / 2
-                    split_points.append(midpoint)
-                segments_dict[filename] = split_points
+                filename = os.path.basename(filename_match.group(1))
+                segments_dict.setdefault(filename, [])
+                continue
+            try:
+                if filename is None:
+                    raise ValueError("range before any [file] header")
+                start, end = line.split('-')
+                start_sec = convert_time_to_seconds(start)
+                end_sec = convert_time_to_seconds(end)
+                if end_sec < start_sec:
+                    raise ValueError("range ends before it starts")
+            except ValueError as e:
+                print(f"Warning: {segments_file_path}:{line_number}: skipping '{line}': {e}")
+                continue
+            segments_dict[filename].append((start_sec, end_sec))
     return segments_dict
 
 def convert_time_to_seconds(time_str):
-    minutes, seconds = map(int, time_str.split(':'))
-    return minutes * 60 + seconds
+    # [h:]m:s with optional fractional seconds
+    seconds = 0.0
+    for part in time_str.strip().split(':'):
+        seconds = seconds * 60 + float(part)
+    return seconds
 
-def extract_features(audio_path, sr=22050, n_mfcc=13, hop_length=512):
+def extract_features(audio_path, sr=22050, n_mfcc=13, hop_length=512, block_seconds=None, timings=None):
+    if block_seconds:
+        import streaming
+        return streaming.extract_features_streaming(audio_path, sr=sr, n_mfcc=n_mfcc, hop_length=hop_length, block_seconds=block_seconds, timings=timings)
+    import librosa
+    start = time.perf_counter()
     y, _ = librosa.load(audio_path, sr=sr)
+    decoded = time.perf_counter()
     mfcc = librosa.feature.mfcc(y=y, sr=sr, n_mfcc=n_mfcc, hop_length=hop_length)
     mfcc = mfcc.T
+    if timings is not None:
+        timings['decode'] = decoded - start
+        timings['features'] = time.perf_counter() - decoded
     return mfcc
 
-def generate_classification_labels(features, split_points, sr=22050, hop_length=512):
-    num_frames = features.shape[0]
-    frame_times = librosa.frames_to_time(np.arange(num_frames), sr=sr, hop_length=hop_length)
-    labels = np.zeros(num_frames)
-    for midpoint in split_points:
-        idx = np.argmin(np.abs(frame_times - midpoint))
-        labels[idx] = 1  # Mark the frame closest to the split point
-    return labels
+def build_window_index(window_labels, hop_frames):
+    # Rows of (file, start frame, label)
+    index = []
+    for file_idx, labels in enumerate(window_labels):
+        file_index = np.empty((len(labels), 3), dtype=np.int64)
+        file_index[:, 0] = file_idx
+        file_index[:, 1] = np.arange(len(labels)) * hop_frames
+        file_index[:, 2] = labels
+        index.append(file_index)
+    if not index:
+        return np.empty((0, 3), dtype=np.int64)
+    return np.concatenate(index, axis=0)
 
-def create_classification_dataset(features, labels, batch_size=32):
-    dataset = tf.data.Dataset.from_tensor_slices((features, labels))
-    dataset = dataset.shuffle(buffer_size=1000)
-    dataset = dataset.batch(batch_size)
-    dataset = dataset.prefetch(tf.data.AUTOTUNE)
-    return dataset
+def window_generator(feature_paths, index, window_frames, shuffle=True):
+    def generate():
+        # Opened per epoch so every pass reads through the page cache instead of holding arrays
+        arrays = [feature_cache.read_features(path, mmap_mode='r') for path in feature_paths]
+        order = np.random.default_rng().permutation(len(index)) if shuffle else np.arange(len(index))
+        for i in order:
+            file_idx, start, label = index[i]
+            yield np.asarray(arrays[file_idx][start:start + window_frames], dtype=np.float32), np.float32(label)
+    return generate
 
-def create_regression_dataset(features, labels, batch_size=32):
-    dataset = tf.data.Dataset.from_tensor_slices((features, labels))
-    dataset = dataset.shuffle(buffer_size=1000)
-    dataset = dataset.batch(batch_size)
-    dataset = dataset.prefetch(tf.data.AUTOTUNE)
-    return dataset
+def create_classification_dataset(feature_paths, window_labels, window_frames, hop_frames=None, batch_size=32, validation_split=0.1):
+    import tensorflow as tf
+    num_features = feature_cache.read_features(feature_paths[0], mmap_mode='r').shape[1]
+    index = build_window_index(window_labels, hop_frames or window_frames)
+    # Whole files are held out: overlapping windows of one file would otherwise sit on both sides of the split
+    counts = np.array([len(labels) for labels in window_labels])
+    order = np.random.default_rng().permutation(len(window_labels))
+    num_held_out = np.searchsorted(np.cumsum(counts[order]), len(index) * validation_split) + 1 if validation_split > 0 else 0
+    held_out = order[:min(num_held_out, len(window_labels) - 1)]
+    validation = np.isin(index[:, 0], held_out)
+    signature = (
+        tf.TensorSpec(shape=(window_frames, num_features), dtype=tf.float32),
+        tf.TensorSpec(shape=(), dtype=tf.float32),
+    )
+    datasets = []
+    for split_index, shuffle in ((index[~validation], True), (index[validation], False)):
+        if len(split_index) == 0:
+            datasets.append(None)
+            continue
+        dataset = tf.data.Dataset.from_generator(window_generator(feature_paths, split_index, window_frames, shuffle), output_signature=signature)
+        if shuffle:
+            dataset = dataset.shuffle(buffer_size=1000)
+        dataset = dataset.batch(batch_size)
+        dataset = dataset.prefetch(tf.data.AUTOTUNE)
+        datasets.append(dataset)
+    train_dataset, validation_dataset = datasets
+    return train_dataset, validation_dataset, (window_frames, num_features)
+
+def create_regression_dataset(features, labels, batch_size=32, validation_split=0.1):
+    import tensorflow as tf
+    # Keras cannot split a dataset itself, so the validation examples are held out here as for classification
+    order = np.random.default_rng().permutation(len(labels))
+    num_held_out = min(int(np.ceil(len(labels) * validation_split)), len(labels) - 1) if validation_split > 0 else 0
+    datasets = []
+    for split_index, shuffle in ((np.sort(order[num_held_out:]), True), (np.sort(order[:num_held_out]), False)):
+        if len(split_index) == 0:
+            datasets.append(None)
+            continue
+        dataset = tf.data.Dataset.from_tensor_slices((features[split_index], labels[split_index]))
+        if shuffle:
+            dataset = dataset.shuffle(buffer_size=1000)
+        dataset = dataset.batch(batch_size)
+        dataset = dataset.prefetch(tf.data.AUTOTUNE)
+        datasets.append(dataset)
+    return tuple(datasets)
 
-def prepare_regression_data(input_dir, feature_dir, segments_dict, classification_model):
+def prepare_regression_data(input_dir, feature_dir, segments_dict, classification_model, sr=22050, hop_length=512,
+                            window_size=30, window_hop=None, regression_window_size=180, num_transitions=5):
     regression_features = []
     regression_labels = []
-    sr = 22050
-    hop_length = 512
-    window_size = 30
-    required_frames = int(window_size * sr / hop_length)
-    regression_window_size = 180
+    required_frames = windowing.seconds_to_frames(window_size, sr, hop_length)
+    hop_frames = windowing.seconds_to_frames(window_hop or window_size, sr, hop_length)
+    model_hash = feature_cache.weights_hash(classification_model)
     for audio_file in os.listdir(input_dir):
-        if not audio_file.endswith('.mp3'):
+        if not audio_file.endswith(audio_extensions):
             continue
         basename = os.path.splitext(audio_file)[0]
-        audio_path = os.path.join(input_dir, audio_file)
-        feature_path = os.path.join(feature_dir, basename + '.npy')
-        features = np.load(feature_path)
-        num_frames = features.shape[0]
-        num_segments = num_frames // required_frames
-        segments = features[:num_segments * required_frames].reshape(num_segments, required_frames, -1)
-        classification_probs = classification_model.predict(segments).flatten()
-        predicted_midpoints = select_transition_points(classification_probs, window_size=window_size, num_transitions=5)
         true_split_points = segments_dict.get(basename, [])
-        audio_duration = librosa.get_duration(filename=audio_path)
-        for midpoint in predicted_midpoints:
-            start_time, duration = get_adjusted_window(midpoint, regression_window_size, audio_duration)
-            segment_features = get_segment_features(features, start_time, duration, sr=sr, hop_length=hop_length)
-            required_frames_reg = int(regression_window_size * sr / hop_length)
-            if segment_features.shape[0] < required_frames_reg:
-                pad_width = required_frames_reg - segment_features.shape[0]
-                segment_features = np.pad(segment_features, ((0, pad_width), (0, 0)), mode='constant')
-            regression_features.append(segment_features)
-            if true_split_points:
-                closest_split_point = find_closest_split_point(midpoint, true_split_points)
-                regression_label = closest_split_point - start_time  # Offset within the window
-                regression_labels.append(regression_label)
-            else:
-                continue
-    return regression_features, regression_labels
+        if not true_split_points:
+            continue
+        audio_path = os.path.join(input_dir, audio_file)
+        features = feature_cache.load_features(audio_path, feature_dir, mmap_mode='r', sr=sr, hop_length=hop_length)
+        classification_probs = feature_cache.get_probabilities(audio_path, classification_model, required_frames, hop_frames, feature_dir,
+                                                               model_hash=model_hash, sr=sr, hop_length=hop_length)
+        if len(classification_probs) == 0:
+            continue
+        predicted_midpoints = select_transition_points(classification_probs, window_size=window_size, num_transitions=num_transitions, window_hop=window_hop,
+                                                       sr=sr, hop_length=hop_length)
+        audio_duration = windowing.frames_duration(len(features), sr, hop_length)
+        start_times, windows = get_regression_windows(features, predicted_midpoints, regression_window_size, audio_duration, sr=sr, hop_length=hop_length)
+        regression_features.append(windows)
+        for midpoint, start_time in zip(predicted_midpoints, start_times):
+            closest_split_point = find_closest_split_point(midpoint, true_split_points)
+            regression_labels.append(closest_split_point - start_time)  # Offset within the window
+    if not regression_features:
+        return None, None
+    return np.concatenate(regression_features, axis=0), np.array(regression_labels, dtype=np.float32)
+
+def get_regression_windows(features, midpoints, regression_window_size, audio_duration, sr=22050, hop_length=512):
+    windows = [get_adjusted_window(midpoint, regression_window_size, audio_duration) for midpoint in midpoints]
+    start_times = np.array([start_time for start_time, _ in windows])
+    start_frames = [windowing.time_to_frame(start_time, sr, hop_length) for start_time, _ in windows]
+    end_frames = [windowing.time_to_frame(start_time + duration, sr, hop_length) for start_time, duration in windows]
+    window_frames = windowing.seconds_to_frames(regression_window_size, sr, hop_length)
+    return start_times, windowing.gather_windows(features, start_frames, window_frames, end_frames)
 
 def get_adjusted_window(midpoint, window_size, audio_duration):
     half_window = window_size / 2
@@ -102,15 +173,39 @@ def get_adjusted_window(midpoint, window_size, audio_duration):
     duration = end_time - start_time
     return start_time, duration
 
-def get_segment_features(features, start_time, duration, sr=22050, hop_length=512):
-    start_frame = int(librosa.time_to_frames(start_time, sr=sr, hop_length=hop_length))
-    end_frame = int(librosa.time_to_frames(start_time + duration, sr=sr, hop_length=hop_length))
-    return features[start_frame:end_frame, :]
+def get_audio_duration(audio_path):
+    import soundfile as sf
+    try:
+        return sf.info(audio_path).duration
+    except sf.SoundFileRuntimeError:
+        import librosa
+        return librosa.get_duration(path=audio_path)
 
-def select_transition_points(probabilities, window_size=30, num_transitions=5):
-    top_indices = np.argsort(probabilities)[-num_transitions:]
-    midpoints = [(idx + 0.5) * window_size for idx in top_indices]
-    return midpoints
+def select_transition_points(probabilities, window_size=30, num_transitions=5, window_hop=None, threshold=None, min_distance=None, sr=22050, hop_length=512):
+    # Greedy non-maximum suppression: peaks closer than min_distance to a stronger one are dropped
+    probabilities = np.asarray(probabilities)
+    window_frames = windowing.seconds_to_frames(window_size, sr, hop_length)
+    hop_frames = windowing.seconds_to_frames(window_hop or window_size, sr, hop_length)
+    min_distance = window_size if min_distance is None else min_distance
+    radius = max(int(np.ceil(min_distance * sr / (hop_frames * hop_length))), 1)
+    candidates = np.arange(len(probabilities)) if threshold is None else np.flatnonzero(probabilities >= threshold)
+    if num_transitions:
+        # Each kept peak suppresses at most 2 * (radius - 1) windows, so the first num_transitions
+        # peaks are among this many strongest windows and the rest never need sorting
+        limit = num_transitions * (2 * radius - 1)
+        if len(candidates) > limit:
+            candidates = candidates[np.argpartition(-probabilities[candidates], limit - 1)[:limit]]
+    order = candidates[np.argsort(-probabilities[candidates], kind='stable')]
+    suppressed = np.zeros(len(probabilities), dtype=bool)
+    peaks = []
+    for idx in order:
+        if suppressed[idx]:
+            continue
+        peaks.append(idx)
+        if len(peaks) == num_transitions:
+            break
+        suppressed[max(idx - radius + 1, 0):idx + radius] = True
+    return windowing.window_midpoints(np.sort(np.asarray(peaks, dtype=np.int64)), window_frames, hop_frames, sr, hop_length).tolist()
 
 def find_closest_split_point(midpoint, true_split_points):
     closest_point = min(true_split_points, key=lambda x: abs(x - midpoint))
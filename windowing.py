@@ -0,0 +1,70 @@
+import numpy as np
+
+def seconds_to_frames(seconds, sr=22050, hop_length=512):
+    return int(seconds * sr / hop_length)
+
+def frames_duration(num_frames, sr=22050, hop_length=512):
+    # Centered frames: n frames cover between (n - 1) and n hops of audio
+    return max(num_frames - 1, 0) * hop_length / sr
+
+def time_to_frame(time, sr=22050, hop_length=512):
+    return int(time * sr) // hop_length
+
+def segment_windows(features, window_frames):
+    num_segments = features.shape[0] // window_frames
+    # Reshaping the leading frames is a view, not a copy
+    return features[:num_segments * window_frames].reshape(num_segments, window_frames, -1)
+
+def count_windows(num_frames, window_frames, hop_frames=None):
+    hop_frames = hop_frames or window_frames
+    if num_frames < window_frames:
+        return 0
+    return (num_frames - window_frames) // hop_frames + 1
+
+def frame_windows(features, window_frames, hop_frames=None):
+    hop_frames = hop_frames or window_frames
+    if hop_frames == window_frames:
+        return segment_windows(features, window_frames)
+    if features.shape[0] < window_frames:
+        return np.empty((0, window_frames, features.shape[1]), dtype=features.dtype)
+    # Overlapping windows are a strided view over the same frames
+    return np.lib.stride_tricks.sliding_window_view(features, window_frames, axis=0)[::hop_frames].transpose(0, 2, 1)
+
+def window_labels(num_frames, split_points, window_frames, hop_frames=None, sr=22050, hop_length=512):
+    hop_frames = hop_frames or window_frames
+    num_windows = count_windows(num_frames, window_frames, hop_frames)
+    labels = np.zeros(num_windows, dtype=np.float32)
+    if num_windows == 0 or len(split_points) == 0:
+        return labels
+    split_frames = np.sort(np.clip(np.round(np.asarray(split_points) * sr / hop_length).astype(np.int64), 0, num_frames - 1))
+    starts = np.arange(num_windows, dtype=np.int64) * hop_frames
+    # A window is positive when any split frame falls in [start, start + window_frames)
+    labels[np.searchsorted(split_frames, starts + window_frames) > np.searchsorted(split_frames, starts)] = 1
+    return labels
+
+def window_midpoints(indices, window_frames, hop_frames=None, sr=22050, hop_length=512):
+    # From frames, since a hop of whole frames is slightly shorter than the nominal seconds and the gap adds up over a file
+    hop_frames = hop_frames or window_frames
+    return (np.asarray(indices) * hop_frames + window_frames / 2) * hop_length / sr
+
+def gather_windows(features, start_frames, window_frames, end_frames=None):
+    start_frames = np.asarray(start_frames, dtype=np.int64)
+    batch = np.zeros((len(start_frames), window_frames, features.shape[1]), dtype=np.float32)
+    if len(start_frames) == 0:
+        return batch
+    full = start_frames + window_frames <= features.shape[0]
+    if not isinstance(features, np.ndarray):
+        # Lazily decoded features: slice each window instead of materializing the whole file
+        full[:] = False
+    if full.any():
+        view = np.lib.stride_tricks.sliding_window_view(features, window_frames, axis=0)
+        batch[full] = view[start_frames[full]].transpose(0, 2, 1)
+    # Windows running past the last frame are zero-padded at the end
+    for i in np.flatnonzero(~full):
+        chunk = features[start_frames[i]:start_frames[i] + window_frames]
+        batch[i, :len(chunk)] = chunk
+    if end_frames is not None:
+        lengths = np.asarray(end_frames, dtype=np.int64) - start_frames
+        for i in np.flatnonzero(lengths < window_frames):
+            batch[i, max(lengths[i], 0):] = 0
+    return batch